@@ -0,0 +1,70 @@
+from pathlib import Path
+import subprocess
+import threading
+from typing import *
+
+class CatFile:
+	'''
+	A long-running 'git cat-file --batch' process for reading files out of a repository's object database at any revision, without checking anything out.
+	One process is kept per repository (see CatFilePool) and reused for every read, instead of starting git for each one
+	'''
+
+	def __init__(self, path: Path):
+		self.path = path
+		self.proc = subprocess.Popen(['git', '-C', str(path), 'cat-file', '--batch'], stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+		self.lock = threading.Lock()
+
+	def query(self, name: str) -> Optional[Tuple[str, bytes]]:
+		# Returns the type and contents of the object 'name' refers to, or None if there's no such object
+		with self.lock:
+			self.proc.stdin.write(f"{name}\n".encode())
+			self.proc.stdin.flush()
+			header = self.proc.stdout.readline().decode()
+			if not header:
+				raise RuntimeError(f"git cat-file exited unexpectedly in {self.path}")
+			fields = header.split()
+			if len(fields) != 3:
+				# "<name> missing" or "<name> ambiguous"
+				return None
+			_, type, size = fields
+			data = self.proc.stdout.read(int(size))
+			self.proc.stdout.read(1) # Trailing newline
+			return type, data
+
+	def hasCommit(self, revision: str) -> bool:
+		return self.query(f"{revision}^{{commit}}") is not None
+
+	def read(self, revision: str, path: str) -> Optional[bytes]:
+		# Returns the contents of 'path' as of 'revision', or None if it doesn't exist there
+		obj = self.query(f"{revision}:{path}")
+		if obj is None or obj[0] != 'blob':
+			return None
+		return obj[1]
+
+	def close(self):
+		if self.proc.poll() is None:
+			self.proc.stdin.close()
+			self.proc.wait()
+		self.proc.stdout.close()
+
+class CatFilePool:
+	'''
+	The CatFile processes one traversal has started, one per repository. Each traversal has its own pool, so closing it when the traversal ends can't
+	kill a process another traversal is in the middle of reading from
+	'''
+
+	def __init__(self):
+		self.processes: Dict[Path, CatFile] = {}
+		self.lock = threading.Lock()
+
+	def forRepo(self, path: Path) -> CatFile:
+		with self.lock:
+			if path not in self.processes:
+				self.processes[path] = CatFile(path)
+			return self.processes[path]
+
+	def close(self):
+		with self.lock:
+			for catFile in self.processes.values():
+				catFile.close()
+			self.processes.clear()
@@ -0,0 +1,80 @@
+from .DB import ActiveRecord
+from .DepsFile import RACY_WINDOW
+from .utils import gitDirs, porcelainStatus, trackedChanges
+
+import json
+from pathlib import Path
+import time
+from typing import *
+
+class CloneStatus(ActiveRecord):
+	'''
+	A clone's branch, how it compares to its upstream, and whether it has uncommitted changes, cached in the database.
+	An entry is reused as long as none of the files it was computed from (the index, HEAD, FETCH_HEAD, and the branch and upstream refs) have been modified since.
+	Editing a tracked file without staging it doesn't touch any of those, so the dirty flag is always rechecked against the working tree
+	'''
+
+	def __init__(self, path: str, stamp: str, status: str):
+		self.path = str(path)
+		self.stamp = stamp # JSON object of file path -> modification time in nanoseconds (null if the file doesn't exist)
+		self.status = status # JSON object, as returned by get()
+
+	@staticmethod
+	def table():
+		return 'clone_statuses'
+
+	@staticmethod
+	def takeStamp(paths: Iterable[Path]) -> Dict[str, Optional[int]]:
+		rtn = {}
+		for path in paths:
+			try:
+				rtn[str(path)] = path.stat().st_mtime_ns
+			except OSError:
+				rtn[str(path)] = None
+		return rtn
+
+	@staticmethod
+	def get(clonePath: Path, useCache: bool = True) -> Dict[str, Any]:
+		dirs = gitDirs(clonePath)
+		if dirs is None:
+			raise RuntimeError(f"{clonePath} is not a git repository")
+		gitDir, commonDir = dirs
+
+		if useCache:
+			entry = CloneStatus.tryLoad(path = str(clonePath))
+			if entry is not None:
+				stamp = json.loads(entry.stamp)
+				rtn = json.loads(entry.status)
+				# A clone with no commits yet has no HEAD to compare the working tree against, so always gets the full check
+				if rtn['head'] is not None and stamp == CloneStatus.takeStamp(map(Path, stamp)):
+					rtn['dirty'] = trackedChanges(clonePath)
+					return rtn
+
+		# Stamp the files before running git, so anything that changes them while it runs invalidates the entry
+		stamp = CloneStatus.takeStamp([gitDir / 'index', gitDir / 'HEAD', gitDir / 'FETCH_HEAD', commonDir / 'packed-refs'])
+		branch, changed = porcelainStatus(clonePath)
+		rtn = {
+			'branch': None if branch.get('head') == '(detached)' else branch.get('head'),
+			'head': None if branch.get('oid') == '(initial)' else branch.get('oid'),
+			'upstream': branch.get('upstream'),
+			'ahead': None,
+			'behind': None,
+			'dirty': changed,
+			'last_fetch': None,
+		}
+		if 'ab' in branch:
+			ahead, behind = branch['ab'].split()
+			rtn['ahead'], rtn['behind'] = int(ahead), -int(behind)
+		refs = []
+		if rtn['branch'] is not None:
+			refs.append(commonDir / 'refs' / 'heads' / rtn['branch'])
+		if rtn['upstream'] is not None:
+			refs.append(commonDir / 'refs' / 'remotes' / rtn['upstream'])
+		stamp.update(CloneStatus.takeStamp(refs))
+		if stamp[str(gitDir / 'FETCH_HEAD')] is not None:
+			rtn['last_fetch'] = stamp[str(gitDir / 'FETCH_HEAD')] // 10**9
+
+		# Files modified this recently might change again without their modification time changing
+		if all(mtime is None or time.time() - mtime / 10**9 > RACY_WINDOW for mtime in stamp.values()):
+			CloneStatus(clonePath, json.dumps(stamp), json.dumps(rtn)).save()
+		return rtn
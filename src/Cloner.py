@@ -0,0 +1,189 @@
+from .Config import config
+from .utils import nullcontext, gitFsmonitorSettings, verbose
+
+import git, gitdb
+import os
+from pathlib import Path
+import random
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import *
+
+# Errors that will fail the same way no matter how many times they're retried. Anything not matching one of these (dropped connections, server overload, etc.) is assumed to be transient
+FATAL_CLONE_ERRORS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+	r'repository .* not found',
+	r'does not appear to be a git repository',
+	r'authentication failed',
+	r'permission denied \(publickey',
+	r'host key verification failed',
+	r'could not read (username|password)',
+	r'returned error: 40[134]',
+	r'remote branch .* not found',
+)]
+
+# Servers that can't send part of a repository's history (e.g. over git's "dumb" HTTP protocol) are fetched from in one go instead
+SHALLOW_UNSUPPORTED = re.compile(r'does not support shallow', re.IGNORECASE)
+
+class CloneError(RuntimeError):
+	def __init__(self, stderr: List[str]):
+		super().__init__("Clone failed:\n" + ''.join(stderr))
+		self.stderr = stderr
+
+	@property
+	def retryable(self) -> bool:
+		return not any(pattern.search(line) for line in self.stderr for pattern in FATAL_CLONE_ERRORS)
+
+def retryDelay(attempt: int) -> float:
+	# Exponential backoff with jitter, so many processes that failed together don't all hit the server together again.
+	# Half the delay is fixed and half is random, which keeps a floor on the wait while still spreading the retries out
+	delay = min(float(config.clone_retry_max_delay), float(config.clone_retry_delay) * (2 ** attempt))
+	return delay / 2 + random.uniform(0, delay / 2)
+
+class Cloner:
+	'''
+	Makes a new clone of 'url' at 'path', with 'git init' and 'git fetch' so a failed fetch can be retried in the same repository.
+	All the work happens in a staging directory next to 'path', which is only renamed into place once the clone is complete.
+	If got is killed partway through a clone, the staging directory is left behind and reused by the next attempt.
+	git discards the partial pack from a fetch that doesn't finish, so history is fetched in steps: first the tip of every branch, then older and older commits until none are missing.
+	A retry (or a later clone reusing the staging directory) picks up after the last step that finished instead of starting over
+	'''
+
+	# How many commits of history the first deepening step fetches. Each step after that fetches twice as many as the one before
+	DEEPEN_START = 64
+
+	# If set, this limits how many clones run at once across every thread in the process (see limit())
+	slots: Optional[threading.Semaphore] = None
+
+	def __init__(self, url: str, path: Path, env: Dict[str, str], progress = None, revision: str = None, branch: str = None):
+		self.url = url
+		self.path = path
+		self.staging = path.parent / f".{path.name}.got-clone"
+		self.env = env
+		self.progress = progress
+		self.revision = revision
+		self.branch = branch
+
+	def git(self, *args: str, check: bool = True) -> subprocess.CompletedProcess:
+		proc = subprocess.run(['git', '-C', str(self.staging), *args], env = self.env, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+		if check and proc.returncode != 0:
+			raise CloneError([proc.stderr])
+		return proc
+
+	def init(self):
+		if self.staging.exists():
+			# Callers hold the repo lock while cloning, so a staging directory that exists now was abandoned by an earlier clone that didn't finish
+			if (self.staging / '.git').is_dir():
+				if verbose(1):
+					print(f"Reusing {self.staging} from an interrupted clone")
+				# Make sure it still points at the right place
+				self.git('remote', 'set-url', 'origin', self.url)
+				return
+			shutil.rmtree(self.staging)
+		os.makedirs(self.staging)
+		self.git('init', '-q')
+		self.git('remote', 'add', 'origin', self.url)
+
+	def fetch(self):
+		try:
+			# Refs from origin mean an earlier attempt got at least as far as the branch tips
+			resumed = self.git('for-each-ref', '--count=1', 'refs/remotes/origin').stdout != ''
+			if not resumed:
+				try:
+					self.fetchStep('--depth', '1')
+				except CloneError as e:
+					if not any(SHALLOW_UNSUPPORTED.search(line) for line in e.stderr):
+						raise
+					self.fetchStep()
+					return
+			depth = self.DEEPEN_START
+			# git removes the 'shallow' file once the history is complete
+			while (self.staging / '.git' / 'shallow').exists():
+				self.fetchStep('--deepen', str(depth))
+				depth *= 2
+			if resumed:
+				# The remote may have moved on since the earlier attempt
+				self.fetchStep()
+		finally:
+			if self.progress is not None:
+				self.progress.finish()
+
+	def fetchStep(self, *args: str):
+		proc = subprocess.Popen(['git', '-C', str(self.staging), 'fetch', '-v', '--progress', *args, 'origin'], env = self.env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+		stderr = []
+		handler = self.progress.new_message_handler() if self.progress is not None else None
+		for line in proc.stderr:
+			stderr.append(line)
+			if handler is not None:
+				handler(line)
+		if proc.wait() != 0:
+			raise CloneError(stderr)
+
+	def remoteHead(self) -> Optional[str]:
+		# The remote's default branch, which 'git fetch' doesn't record. None if the remote has no HEAD (e.g. it's empty)
+		for line in self.git('ls-remote', '--symref', 'origin', 'HEAD').stdout.splitlines():
+			if line.startswith('ref: refs/heads/') and line.endswith('\tHEAD'):
+				return line[len('ref: refs/heads/'):-len('\tHEAD')]
+		return None
+
+	def checkout(self, head: Optional[str]):
+		# Check out the remote's default branch, the way 'git clone' would. If the remote has no HEAD, leave the new branch unborn
+		for key, value in gitFsmonitorSettings().items():
+			self.git('config', key, value)
+		if head is not None:
+			self.git('symbolic-ref', 'refs/remotes/origin/HEAD', f"refs/remotes/origin/{head}")
+			self.git('checkout', '-q', '-B', head, '--track', f"origin/{head}")
+
+		if self.revision is not None:
+			r = git.Repo(str(self.staging))
+			try:
+				r.head.reference = r.commit(self.revision)
+				r.head.reset(index = True, working_tree = True)
+			except gitdb.exc.BadName:
+				r.git.checkout(self.revision, '--')
+			finally:
+				r.close()
+		elif self.branch is not None:
+			r = git.Repo(str(self.staging))
+			try:
+				r.git.checkout(self.branch, '--')
+			except git.exc.GitCommandError:
+				pass
+			finally:
+				r.close()
+
+	@classmethod
+	def limit(cls, jobs: int):
+		# Caps how many clones this process runs at once, for callers that resolve independent requests on their own threads and so can't share one worker pool
+		cls.slots = threading.BoundedSemaphore(jobs)
+
+	def clone(self):
+		with self.slots or nullcontext():
+			attempts = int(config.clone_retries) + 1
+			for attempt in range(attempts):
+				try:
+					self.init()
+					self.fetch()
+					head = self.remoteHead()
+					break
+				except CloneError as e:
+					if not e.retryable:
+						shutil.rmtree(self.staging, ignore_errors = True)
+						raise
+					if attempt + 1 == attempts:
+						# The staging directory is reused by the next attempt to clone this repo
+						if verbose(2):
+							print(f"Incomplete clone left in {self.staging}")
+						raise
+					delay = retryDelay(attempt)
+					if verbose(2):
+						print(f"Clone failed (will retry in {delay:.1f}s):\n" + ''.join(e.stderr))
+					time.sleep(delay)
+			try:
+				self.checkout(head)
+			except (CloneError, git.exc.GitCommandError):
+				shutil.rmtree(self.staging, ignore_errors = True)
+				raise
+			os.replace(self.staging, self.path)
@@ -6,11 +6,28 @@ from pathlib import Path
 from typing import *
 
 DEFAULT_CONFIG: Dict[str, Any] = {
+	'clone_jobs': 4,
 	'clone_retries': 0,
+	'clone_retry_delay': 5,
+	'clone_retry_max_delay': 300,
 	'clone_root': gotRoot / 'repos',
 	'default_branch': ':head',
+	'git_fsmonitor': 'false',
+	'run_cache_max_age': 7,
+	'run_cache_max_size': 100,
+	'run_job_memory': 512,
+	'run_max_cpu': 90,
+	'run_max_jobs': 0,
+	'ssh_control_persist': 60,
 }
 
+def cloneJobsValidator(v: str):
+	try:
+		if int(v) < 1:
+			raise ValueError("Non-positive")
+	except ValueError:
+		raise ValueError("clone_jobs must be a positive integer")
+
 def cloneRetriesValidator(v: str):
 	try:
 		if int(v) < 0:
@@ -18,6 +35,52 @@ def cloneRetriesValidator(v: str):
 	except ValueError:
 		raise ValueError("clone_retries must be a non-negative integer")
 
+def cloneRetryDelayValidator(v: str):
+	try:
+		if float(v) < 0:
+			raise ValueError("Negative")
+	except ValueError:
+		raise ValueError("Clone retry delays must be non-negative numbers of seconds")
+
+def runCacheLimitValidator(v: str):
+	try:
+		if float(v) < 0:
+			raise ValueError("Negative")
+	except ValueError:
+		raise ValueError("Run cache limits must be non-negative numbers")
+
+def runJobMemoryValidator(v: str):
+	try:
+		if float(v) < 0:
+			raise ValueError("Negative")
+	except ValueError:
+		raise ValueError("run_job_memory must be a non-negative number of MiB")
+
+def runMaxCpuValidator(v: str):
+	try:
+		if not 0 < float(v) <= 100:
+			raise ValueError("Out of range")
+	except ValueError:
+		raise ValueError("run_max_cpu must be a percentage greater than 0 and at most 100")
+
+def runMaxJobsValidator(v: str):
+	try:
+		if int(v) < 0:
+			raise ValueError("Negative")
+	except ValueError:
+		raise ValueError("run_max_jobs must be a non-negative integer")
+
+def sshControlPersistValidator(v: str):
+	try:
+		if int(v) < 0:
+			raise ValueError("Negative")
+	except ValueError:
+		raise ValueError("ssh_control_persist must be a non-negative integer number of seconds")
+
+def gitFsmonitorValidator(v: str):
+	if v not in ('true', 'false'):
+		raise ValueError("git_fsmonitor must be 'true' or 'false'")
+
 def cloneRootValidator(v: str) -> str:
 	return str(Path(v).resolve())
 
@@ -26,9 +89,19 @@ def defaultBranchValidator(v: str):
 		raise ValueError(f"Unrecognized default branch: {v}")
 
 CONFIG_VALIDATORS: Dict[str, Callable[[str], Optional[str]]] = {
+	'clone_jobs': cloneJobsValidator,
 	'clone_retries': cloneRetriesValidator,
+	'clone_retry_delay': cloneRetryDelayValidator,
+	'clone_retry_max_delay': cloneRetryDelayValidator,
 	'clone_root': cloneRootValidator,
 	'default_branch': defaultBranchValidator,
+	'git_fsmonitor': gitFsmonitorValidator,
+	'run_cache_max_age': runCacheLimitValidator,
+	'run_cache_max_size': runCacheLimitValidator,
+	'run_job_memory': runJobMemoryValidator,
+	'run_max_cpu': runMaxCpuValidator,
+	'run_max_jobs': runMaxJobsValidator,
+	'ssh_control_persist': sshControlPersistValidator,
 }
 
 class Config(ActiveRecord):
@@ -1,11 +1,14 @@
+import collections
 from contextlib import contextmanager
 import inspect
+import itertools
 import os
 from pathlib import Path
 import psutil
 import re
 import sqlite3
 import sys
+import threading
 import time
 import traceback
 from typing import *
@@ -97,23 +100,45 @@ def v3(db):
 	db.update("ALTER TABLE bitbucket_hosts ADD clone_root text");
 	db.update("ALTER TABLE daemon_hosts ADD clone_root text");
 
-def savepointNameGenerator():
-	i = 1
-	while True:
-		yield f"savepoint_{i}"
-		i += 1
-savepointNameGenerator = savepointNameGenerator()
+@schemaUpdate
+def v4(db):
+	# Track clones that are in progress, so other processes that want the same repository can wait for them
+	db.update("CREATE TABLE inflight_clones(key text PRIMARY KEY, pid int NOT NULL, repospec RepoSpec NOT NULL, path Path NOT NULL, status text NOT NULL, op int, count int, total int, message text, error text, updated real NOT NULL)")
+
+@schemaUpdate
+def v5(db):
+	# Cache parsed dependency files, keyed on their stat info
+	db.update("CREATE TABLE deps_files(path Path PRIMARY KEY, mtime_ns int NOT NULL, size int NOT NULL, deps text NOT NULL)")
+
+@schemaUpdate
+def v6(db):
+	# Cache clone statuses for --status, keyed on the modification times of the git files they were computed from
+	db.update("CREATE TABLE clone_statuses(path Path PRIMARY KEY, stamp text NOT NULL, status text NOT NULL)")
+
+# itertools.count is safe to share between threads, unlike a generator
+savepointCounter = itertools.count(1)
 
 class DB:
 	def __init__(self, dir: Path):
 		os.makedirs(dir, exist_ok = True)
 		self.path = dir / 'db'
-		self.conn = sqlite3.connect(str(self.path), isolation_level = None)
-		self.conn.row_factory = sqlite3.Row
+		self.local = threading.local()
+		self.threadLocks: Dict[str, threading.RLock] = collections.defaultdict(threading.RLock)
+		self.threadLocksLock = threading.Lock()
 		self.schemaUpdates()
 
+	@property
+	def conn(self) -> sqlite3.Connection:
+		# sqlite connections can't be shared between threads, so each thread gets its own
+		conn = getattr(self.local, 'conn', None)
+		if conn is None:
+			conn = self.local.conn = sqlite3.connect(str(self.path), isolation_level = None, timeout = 30)
+			conn.row_factory = sqlite3.Row
+		return conn
+
 	def close(self):
 		self.conn.close()
+		self.local.conn = None
 
 	def schemaUpdates(self):
 		with self.transaction(True):
@@ -158,9 +183,18 @@ class DB:
 
 	@contextmanager
 	def transaction(self, exclusive = False):
-		savepointName = next(savepointNameGenerator)
+		savepointName = f"savepoint_{next(savepointCounter)}"
 		oldLevel = self.conn.isolation_level # This is almost certainly None, which is auto-commit mode
 		self.conn.isolation_level = 'EXCLUSIVE' if exclusive else '' # Empty string is regular transactional mode
+		# A savepoint starts a deferred transaction. If two connections both read and then try to write, one fails immediately with "database is locked" instead of waiting,
+		# which is easy to hit now that each thread has its own connection. Exclusive transactions take the write lock up front to avoid that
+		begin = exclusive and not self.conn.in_transaction
+		try:
+			if begin:
+				self.conn.execute("BEGIN EXCLUSIVE")
+		except:
+			self.conn.isolation_level = oldLevel
+			raise
 		try:
 			# pysqlite's need to automate certain transaction operations really screws up DDL instructions.
 			# Savepoints seem to avoid the problem
@@ -168,14 +202,32 @@ class DB:
 			self.conn.execute(f"SAVEPOINT {savepointName}")
 			yield
 			self.conn.execute(f"RELEASE SAVEPOINT {savepointName}")
+			if begin:
+				self.conn.execute("COMMIT")
 		except:
 			self.conn.execute(f"ROLLBACK TO SAVEPOINT {savepointName}")
+			if begin:
+				self.conn.execute("ROLLBACK")
 			raise
 		finally:
 			self.conn.isolation_level = oldLevel
 
 	@contextmanager
-	def lock(self, key, timeout = None, reentrant = True):
+	def lock(self, key, timeout = None, reentrant = True, onWait = None):
+		# The locks table only tells processes apart, so threads within this process need to exclude each other separately
+		with self.threadLocksLock:
+			threadLock = self.threadLocks[key]
+		if not threadLock.acquire(timeout = -1 if timeout is None else timeout):
+			raise TimeoutError(f"Unable to acquire lock ({key} held by another thread)")
+		try:
+			with self.processLock(key, timeout, reentrant, onWait):
+				yield
+		finally:
+			threadLock.release()
+
+	@contextmanager
+	def processLock(self, key, timeout, reentrant, onWait = None):
+		# If 'onWait' is set, it's called each time the lock turns out to be held by another process, before waiting to try again
 		pid = os.getpid()
 		tries = 0
 		while True:
@@ -206,6 +258,8 @@ class DB:
 					print(f"Waiting for lock... (held by {owner}, run by {parent.pid} ({parent.name()}))", file = sys.stderr)
 				except Exception: # 'owner' might have ended, or be restricted, or its parent might be unavailable
 					print(f"Waiting for lock... (held by {owner})", file = sys.stderr)
+			if onWait is not None:
+				onWait()
 			time.sleep(1)
 
 		try:
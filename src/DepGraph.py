@@ -0,0 +1,107 @@
+from .Clone import Clone
+
+import json
+from typing import *
+
+class DepGraph:
+	'''
+	A dependency graph: each node is a clone, with edges to the clones it depends on.
+	Nodes are identified by their full repospec, and kept in the order they were added
+	'''
+
+	def __init__(self):
+		self.nodes: Dict[str, Clone] = {}
+		self.edges: Dict[str, List[str]] = {}
+
+	def addNode(self, clone: Clone, deps: Iterable[str]):
+		key = str(clone.repospec)
+		self.nodes[key] = clone
+		self.edges[key] = list(deps)
+
+	def components(self) -> List[List[str]]:
+		# Strongly connected components (Tarjan's algorithm). Components come out in reverse topological order: every component is listed after everything it depends on.
+		# This is iterative because a long dependency chain would blow Python's recursion limit
+		index: Dict[str, int] = {}
+		lowlink: Dict[str, int] = {}
+		stack: List[str] = []
+		onStack: Set[str] = set()
+		rtn = []
+		for start in self.nodes:
+			if start in index:
+				continue
+			work = [(start, 0)]
+			while work:
+				node, i = work.pop()
+				if i == 0:
+					index[node] = lowlink[node] = len(index)
+					stack.append(node)
+					onStack.add(node)
+				edges = self.edges[node]
+				# Find the next successor that hasn't been visited yet
+				while i < len(edges):
+					succ = edges[i]
+					i += 1
+					if succ not in index:
+						work.append((node, i))
+						work.append((succ, 0))
+						break
+					if succ in onStack:
+						lowlink[node] = min(lowlink[node], index[succ])
+				else:
+					# Done with this node
+					if lowlink[node] == index[node]:
+						component = []
+						while True:
+							member = stack.pop()
+							onStack.remove(member)
+							component.append(member)
+							if member == node:
+								break
+						rtn.append(component[::-1])
+					if work:
+						parent = work[-1][0]
+						lowlink[parent] = min(lowlink[parent], lowlink[node])
+		return rtn
+
+	def analyze(self) -> Tuple[List[List[str]], Dict[str, int]]:
+		# Returns the cycles in the graph and each node's topological level. Nodes with no dependencies are level 0, and every other node is one level above its highest dependency, so
+		# everything at the same level can be built at once. All the nodes in a cycle share a level
+		cycles = []
+		levels: Dict[str, int] = {}
+		for component in self.components():
+			members = set(component)
+			if len(component) > 1 or component[0] in self.edges[component[0]]:
+				cycles.append(component)
+			level = max((levels[succ] + 1 for node in component for succ in self.edges[node] if succ not in members), default = 0)
+			for node in component:
+				levels[node] = level
+		return cycles, levels
+
+	def toJSON(self) -> str:
+		cycles, levels = self.analyze()
+		byLevel = [[] for _ in range(max(levels.values(), default = -1) + 1)]
+		for node in self.nodes:
+			byLevel[levels[node]].append(node)
+		return json.dumps({
+			'nodes': [{'id': node, 'path': str(clone.path), 'level': levels[node]} for node, clone in self.nodes.items()],
+			'edges': [{'from': node, 'to': succ} for node, edges in self.edges.items() for succ in edges],
+			'cycles': cycles,
+			'levels': byLevel,
+		})
+
+	def toDot(self) -> str:
+		cycles, levels = self.analyze()
+		cycleOf = {node: i for i, cycle in enumerate(cycles) for node in cycle}
+		quote = lambda s: '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+		lines = ['digraph deps {']
+		for node, clone in self.nodes.items():
+			lines.append(f"\t{quote(node)} [label={quote(clone.repospec.str(includeHost = False))}];")
+		for node, edges in self.edges.items():
+			for succ in edges:
+				# Edges within a cycle are highlighted
+				attrs = ' [color=red]' if node in cycleOf and cycleOf.get(succ) == cycleOf[node] else ''
+				lines.append(f"\t{quote(node)} -> {quote(succ)}{attrs};")
+		for level in sorted(set(levels.values())):
+			lines.append(f"\t{{ rank=same; {' '.join(quote(node) for node in self.nodes if levels[node] == level)} }}")
+		lines.append('}')
+		return '\n'.join(lines)
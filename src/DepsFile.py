@@ -0,0 +1,52 @@
+from .DB import ActiveRecord
+from .RepoSpec import RepoSpec
+
+import json
+from pathlib import Path
+import time
+from typing import *
+
+# A deps.got modified this recently might be modified again within the same timestamp tick, so its stat info can't be trusted to detect the change
+RACY_WINDOW = 2
+
+class DepsFile(ActiveRecord):
+	'''
+	The parsed contents of a clone's deps.got, cached in the database so traversing an unchanged dependency graph doesn't need to read and parse every file.
+	An entry is only used if the file's modification time and size still match; otherwise the file is re-read and the entry replaced
+	'''
+
+	def __init__(self, path: str, mtime_ns: int, size: int, deps: str):
+		self.path = str(path)
+		self.mtime_ns = mtime_ns
+		self.size = size
+		self.deps = deps # JSON list of [name, revision, host]
+
+	def specs(self) -> List[RepoSpec]:
+		return [RepoSpec(*fields) for fields in json.loads(self.deps)]
+
+	@staticmethod
+	def parse(text: str) -> List[RepoSpec]:
+		return [RepoSpec.fromStr(depSpec) for depSpec in text.split()]
+
+	@staticmethod
+	def loadCache() -> Dict[str, 'DepsFile']:
+		return {entry.path: entry for entry in DepsFile.loadAll()}
+
+	@staticmethod
+	def read(clonePath: Path, cache: Optional[Dict[str, 'DepsFile']] = None) -> Optional[List[RepoSpec]]:
+		# Returns the dependencies listed in the clone's deps.got, or None if it doesn't have one. 'cache' comes from loadCache(); if omitted, the file is always read
+		path = clonePath / 'deps.got'
+		try:
+			stat = path.stat()
+		except FileNotFoundError:
+			return None
+
+		if cache is not None:
+			entry = cache.get(str(path))
+			if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+				return entry.specs()
+
+		specs = DepsFile.parse(path.read_text())
+		if time.time() - stat.st_mtime > RACY_WINDOW:
+			DepsFile(path, stat.st_mtime_ns, stat.st_size, json.dumps([[spec.name, spec.revision, spec.host] for spec in specs])).save()
+		return specs
@@ -0,0 +1,57 @@
+from .RepoSpec import RepoSpec
+
+import hashlib
+import json
+from pathlib import Path
+from typing import *
+
+LOCK_VERSION = 1
+
+class LockedRepo:
+	def __init__(self, repospec: RepoSpec, host: Optional[str], url: Optional[str], sha: Optional[str]):
+		self.repospec = repospec if isinstance(repospec, RepoSpec) else RepoSpec.fromStr(repospec)
+		self.host = host
+		self.url = url
+		self.sha = sha
+
+	def toJSON(self) -> Dict[str, Optional[str]]:
+		return {'repospec': str(self.repospec), 'host': self.host, 'url': self.url, 'sha': self.sha}
+
+class DepsLock:
+	'''
+	A repo's whole resolved dependency closure, written to deps.lock next to its deps.got: every transitive dependency's repospec, host, clone URL, and commit.
+	As long as deps.got hasn't changed since the lock was written, traversals use the locked list directly instead of reading every dependency's deps.got and looking repos up on their hosts
+	'''
+
+	def __init__(self, depsHash: Optional[str], repos: List[LockedRepo]):
+		self.depsHash = depsHash
+		self.repos = repos
+
+	@staticmethod
+	def hashDepsFile(clonePath: Path) -> Optional[str]:
+		try:
+			return hashlib.sha256((clonePath / 'deps.got').read_bytes()).hexdigest()
+		except FileNotFoundError:
+			return None
+
+	@classmethod
+	def load(cls, clonePath: Path) -> Optional['DepsLock']:
+		# Returns None if there's no lockfile, or it's unreadable or from an incompatible version of got
+		try:
+			data = json.loads((clonePath / 'deps.lock').read_text())
+			if data['version'] != LOCK_VERSION:
+				return None
+			return cls(data['deps_hash'], [LockedRepo(repo['repospec'], repo['host'], repo['url'], repo['sha']) for repo in data['repos']])
+		except (FileNotFoundError, ValueError, KeyError, TypeError):
+			return None
+
+	def isValid(self, clonePath: Path) -> bool:
+		return self.depsHash == DepsLock.hashDepsFile(clonePath)
+
+	def save(self, clonePath: Path):
+		data = {
+			'version': LOCK_VERSION,
+			'deps_hash': self.depsHash,
+			'repos': [repo.toJSON() for repo in self.repos],
+		}
+		(clonePath / 'deps.lock').write_text(json.dumps(data, indent = '\t') + '\n')
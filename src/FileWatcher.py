@@ -0,0 +1,141 @@
+import abc
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import time
+from typing import *
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct('iIII')
+
+class FileWatcher(abc.ABC):
+	'''Reports when any of a set of files is created, changed, or deleted'''
+
+	@abc.abstractmethod
+	def watch(self, path: Path):
+		pass
+
+	@abc.abstractmethod
+	def unwatch(self, path: Path):
+		pass
+
+	@abc.abstractmethod
+	def wait(self, timeout: float) -> Set[Path]:
+		# Waits up to 'timeout' seconds for changes, and returns the watched files that changed (if any)
+		pass
+
+	def close(self):
+		pass
+
+class InotifyWatcher(FileWatcher):
+	'''
+	Uses Linux's inotify to hear about changes as they happen. Files are watched through their directory, so replacing a file (the way many editors save) is seen too
+	'''
+
+	def __init__(self, libc: ctypes.CDLL):
+		self.libc = libc
+		self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+		self.dirs: Dict[Path, int] = {} # Directory -> watch descriptor
+		self.wds: Dict[int, Path] = {}
+		self.files: Set[Path] = set()
+
+	def watch(self, path: Path):
+		if path in self.files:
+			return
+		self.files.add(path)
+		if path.parent not in self.dirs:
+			wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path.parent)), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+			if wd < 0:
+				# Most likely the directory doesn't exist (anymore)
+				self.files.discard(path)
+				return
+			self.dirs[path.parent] = wd
+			self.wds[wd] = path.parent
+
+	def unwatch(self, path: Path):
+		self.files.discard(path)
+		if path.parent in self.dirs and not any(f.parent == path.parent for f in self.files):
+			wd = self.dirs.pop(path.parent)
+			del self.wds[wd]
+			self.libc.inotify_rm_watch(self.fd, wd)
+
+	def wait(self, timeout: float) -> Set[Path]:
+		rtn = set()
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		while readable:
+			try:
+				buf = os.read(self.fd, 64 * 1024)
+			except BlockingIOError:
+				break
+			offset = 0
+			while offset < len(buf):
+				wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+				name = buf[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b'\0')
+				offset += EVENT_HEADER.size + length
+				if wd in self.wds:
+					path = self.wds[wd] / os.fsdecode(name)
+					if path in self.files:
+						rtn.add(path)
+		return rtn
+
+	def close(self):
+		os.close(self.fd)
+
+class PollingWatcher(FileWatcher):
+	'''For platforms without inotify: checks each watched file's size and modification time every 'interval' seconds'''
+
+	def __init__(self, interval: float = 1):
+		self.interval = interval
+		self.files: Dict[Path, Optional[Tuple[int, int]]] = {}
+		self.lastPoll = time.time()
+
+	@staticmethod
+	def stat(path: Path) -> Optional[Tuple[int, int]]:
+		try:
+			st = path.stat()
+			return st.st_mtime_ns, st.st_size
+		except OSError:
+			return None
+
+	def watch(self, path: Path):
+		if path not in self.files:
+			self.files[path] = self.stat(path)
+
+	def unwatch(self, path: Path):
+		self.files.pop(path, None)
+
+	def wait(self, timeout: float) -> Set[Path]:
+		time.sleep(max(0, min(timeout, self.lastPoll + self.interval - time.time())))
+		if time.time() < self.lastPoll + self.interval:
+			return set()
+		self.lastPoll = time.time()
+		rtn = set()
+		for path, old in self.files.items():
+			new = self.stat(path)
+			if new != old:
+				self.files[path] = new
+				rtn.add(path)
+		return rtn
+
+def makeWatcher() -> FileWatcher:
+	if sys.platform.startswith('linux'):
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+			return InotifyWatcher(libc)
+		except (OSError, AttributeError):
+			pass
+	return PollingWatcher()
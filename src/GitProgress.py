@@ -1,13 +1,58 @@
+import json
+import os
+import re
 import rich.console
 import rich.progress
 import sys
+import threading
+import time
+from typing import *
 
 from git.util import RemoteProgress
 
+from .utils import verbose
+
 if sys.platform == 'win32':
 	# Console.show_cursor() doesn't work on Windows (https://github.com/willmcgugan/rich/issues/75)
 	rich.console.Console.show_cursor = lambda *args, **kw: None
 
+OPCODE_NAMES = {
+	RemoteProgress.COUNTING: 'Counting',
+	RemoteProgress.COMPRESSING: 'Compressing',
+	RemoteProgress.WRITING: 'Writing',
+	RemoteProgress.RECEIVING: 'Receiving',
+	RemoteProgress.RESOLVING: 'Resolving',
+	RemoteProgress.FINDING_SOURCES: 'Finding sources',
+	RemoteProgress.CHECKING_OUT: 'Checking out',
+}
+
+# While receiving objects, git's progress message is e.g. "1.50 MiB | 750.00 KiB/s"
+TRANSFER_PATTERN = re.compile(r'^(?P<received>[0-9.]+ (?:[KMGT]iB|bytes?))(?: \| (?P<rate>[0-9.]+ (?:[KMGT]iB|bytes?)/s))?')
+SIZE_UNITS = {'byte': 1, 'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+def parseSize(size: Optional[str]) -> Optional[int]:
+	# Turn one of git's human-readable sizes (e.g. "1.50 MiB" or "750.00 KiB/s") into bytes
+	if not size:
+		return None
+	num, unit = size.split(' ')
+	unit = unit[:-2] if unit.endswith('/s') else unit
+	return int(float(num) * SIZE_UNITS.get(unit, 1))
+
+# Set from the command line by configure(); 'rich' draws progress bars on the terminal, 'json' writes events to progressStream
+progressFormat = 'rich'
+progressStream = None
+
+def configure(format: str, fd: int):
+	global progressFormat, progressStream
+	progressFormat = format
+	if format == 'json':
+		progressStream = os.fdopen(fd, 'w', closefd = False)
+
+def makeProgress(name: str) -> Optional[RemoteProgress]:
+	if progressFormat == 'json':
+		return JsonProgress(progressStream, name)
+	return GitProgress() if verbose(1) and sys.stdout.isatty() else None
+
 class GitProgress(RemoteProgress):
 	def __init__(self):
 		super().__init__()
@@ -22,28 +67,19 @@ class GitProgress(RemoteProgress):
 		self.task = None
 
 	def update(self, opcode, count, max, msg = None):
-		opcodeStrs = {
-			self.COUNTING: 'Counting',
-			self.COMPRESSING: 'Compressing',
-			self.WRITING: 'Writing',
-			self.RECEIVING: 'Receiving',
-			self.RESOLVING: 'Resolving',
-			self.FINDING_SOURCES: 'Finding sources',
-			self.CHECKING_OUT: 'Checking out',
-		}
 		stage, realOpcode = opcode & self.STAGE_MASK, opcode & self.OP_MASK
 
 		try:
 			count = int(count)
 			max = int(max)
-		except ValueError:
+		except (TypeError, ValueError):
 			return
 
 		if self.currentOpcode != realOpcode:
 			if self.task:
 				self.progress.update(self.task, total = 1, completed = 1, msg = '')
 			self.currentOpcode = realOpcode
-			self.task = self.progress.add_task(opcodeStrs[realOpcode].ljust(15), msg = '')
+			self.task = self.progress.add_task(OPCODE_NAMES[realOpcode].ljust(15), msg = '')
 
 		if stage & self.BEGIN:
 			self.progress.start()
@@ -57,3 +93,137 @@ class GitProgress(RemoteProgress):
 
 	def __exit__(self, type, val, tb):
 		self.progress.stop()
+
+class CloneDashboard:
+	'''
+	A single live display for many clones running at once. Each active clone gets a row with its current phase, bytes received, throughput, and ETA,
+	and an overall row counts finished repositories. The display is redrawn at most 'refreshPerSecond' times a second no matter how often git reports progress
+	'''
+
+	def __init__(self, total: int, refreshPerSecond: float = 2):
+		self.progress = rich.progress.Progress(
+			"[progress.description]{task.description}",
+			"{task.fields[phase]}",
+			rich.progress.BarColumn(None),
+			"[progress.percentage]{task.percentage:>3.0f}%",
+			"[progress.filesize]{task.fields[received]}",
+			"[progress.data.speed]{task.fields[rate]}",
+			rich.progress.TimeRemainingColumn(),
+			console = rich.console.Console(file = sys.stderr),
+			refresh_per_second = refreshPerSecond,
+		)
+		self.overall = self.progress.add_task('Total', total = total, phase = '', received = '', rate = '')
+
+	def track(self, name: str) -> 'DashboardProgress':
+		return DashboardProgress(self, name)
+
+	def advance(self):
+		self.progress.advance(self.overall)
+
+	def __enter__(self):
+		self.progress.start()
+		return self
+
+	def __exit__(self, type, val, tb):
+		self.progress.stop()
+
+class DashboardProgress(RemoteProgress):
+	'''Progress handler for one clone's row of a CloneDashboard. The row is only shown while inside a with-block'''
+
+	def __init__(self, dashboard: CloneDashboard, name: str):
+		super().__init__()
+		self.dashboard = dashboard
+		self.name = name
+		self.task = None
+		self.currentOpcode = None
+		self.received = ''
+
+	def update(self, opcode, count, max, msg = None):
+		if self.task is None:
+			return
+		try:
+			count = int(count)
+			max = int(max)
+		except (TypeError, ValueError):
+			return
+
+		realOpcode = opcode & self.OP_MASK
+		fields = {'phase': OPCODE_NAMES[realOpcode].ljust(15)}
+		match = TRANSFER_PATTERN.match(msg or '')
+		if match:
+			self.received = match.group('received')
+			fields['rate'] = match.group('rate') or ''
+		else:
+			fields['rate'] = ''
+		fields['received'] = self.received
+		if self.currentOpcode != realOpcode:
+			# Each phase counts something different, so start the ETA estimate over
+			self.currentOpcode = realOpcode
+			self.dashboard.progress.reset(self.task, total = max, completed = count, **fields)
+		else:
+			self.dashboard.progress.update(self.task, total = max, completed = count, **fields)
+
+	def finish(self):
+		pass
+
+	def __enter__(self):
+		self.task = self.dashboard.progress.add_task(self.name, total = None, phase = 'Starting'.ljust(15), received = '', rate = '')
+
+	def __exit__(self, type, val, tb):
+		self.dashboard.progress.remove_task(self.task)
+		self.task = None
+
+class JsonProgress(RemoteProgress):
+	'''
+	Writes progress as newline-delimited JSON events, for other tools to display however they like.
+	Events within a phase are rate limited to one per 'interval' seconds; the start and end of each phase are always written
+	'''
+
+	lock = threading.Lock()
+
+	def __init__(self, stream, name: str, interval: float = .25):
+		super().__init__()
+		self.stream = stream
+		self.name = name
+		self.interval = interval
+		self.currentOpcode = None
+		self.lastEmit = 0
+		self.received = None
+
+	def emit(self, phase: str, count: Optional[float] = None, total: Optional[float] = None, rate: Optional[int] = None):
+		self.lastEmit = time.time()
+		event = {
+			'repospec': self.name,
+			'phase': phase,
+			'count': int(count) if count is not None else None,
+			'total': int(total) if total is not None else None,
+			'bytes': self.received,
+			'rate': rate,
+			'timestamp': self.lastEmit,
+		}
+		# Several clones can be writing to the same stream from different threads
+		with JsonProgress.lock:
+			self.stream.write(json.dumps(event) + '\n')
+			self.stream.flush()
+
+	def update(self, opcode, count, max, msg = None):
+		realOpcode = opcode & self.OP_MASK
+		match = TRANSFER_PATTERN.match(msg or '')
+		if match:
+			self.received = parseSize(match.group('received'))
+		if realOpcode == self.currentOpcode and not opcode & self.END and time.time() - self.lastEmit < self.interval:
+			return
+		self.currentOpcode = realOpcode
+		try:
+			self.emit(OPCODE_NAMES[realOpcode].lower(), count, max, parseSize(match.group('rate')) if match else None)
+		except (TypeError, ValueError):
+			pass
+
+	def finish(self):
+		pass
+
+	def __enter__(self):
+		self.emit('starting')
+
+	def __exit__(self, type, val, tb):
+		self.emit('done' if type is None else 'failed')
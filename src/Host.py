@@ -4,7 +4,11 @@ import git
 import os
 from pathlib import Path
 import re
+import requests
 import stashy
+import subprocess
+import tempfile
+from typing import *
 
 from .Credential import Credential
 from .Config import config
@@ -128,7 +132,36 @@ class SubclassableHost:
 	def check(self):
 		pass
 
+	def getDepsFile(self, name: str, revision: Optional[str] = None, url: Optional[str] = None) -> Optional[str]:
+		# Returns the contents of the repo's deps.got (at 'revision', or the default branch) without cloning it, or None if it doesn't have one.
+		# This works with any git server by fetching just that one commit into a throwaway bare repository
+		if url is None:
+			url = self.getCloneURL(name)
+		env = dict(os.environ)
+		env.update(makeGitEnvironment(self))
+		with tempfile.TemporaryDirectory(prefix = 'got-deps-') as tmp:
+			def run(*args):
+				return subprocess.run(['git', '-C', tmp, *args], env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+			run('init', '-q', '--bare')
+			proc = run('fetch', '-q', '--depth', '1', '--no-tags', url, revision or 'HEAD')
+			commit = 'FETCH_HEAD'
+			if proc.returncode != 0 and revision is not None:
+				# Servers don't have to allow fetching a commit by SHA, so fall back to fetching all the branches and looking for it
+				proc = run('fetch', '-q', '--no-tags', url, '+refs/heads/*:refs/heads/*')
+				commit = revision
+			if proc.returncode != 0:
+				raise RuntimeError(f"Unable to fetch {url}: {proc.stderr.strip()}")
+			proc = run('cat-file', 'blob', f"{commit}:deps.got")
+			return proc.stdout if proc.returncode == 0 else None
+
+	def getRepoSize(self, name: str) -> Optional[int]:
+		# The size of the repository in bytes, if the host can tell without cloning it
+		return None
+
 class BitbucketHost(SubclassableHost, ActiveRecord):
+	# Seconds to wait for a REST API response, so an unresponsive server fails the lookup instead of hanging it
+	REQUEST_TIMEOUT = 30
+
 	def __init__(self, name, url, username, ssh_key_path = None, clone_url = None, clone_root = None):
 		self._conn = None # Lazy loaded via self.conn property
 		super().__init__(name, url, username, ssh_key_path, clone_url, clone_root)
@@ -162,11 +195,16 @@ class BitbucketHost(SubclassableHost, ActiveRecord):
 	def getType(self = None):
 		return 'bitbucket'
 
-	def getCloneURL(self, name):
+	@staticmethod
+	def splitName(name):
 		try:
 			project, repoName = name.split('/')
 		except ValueError:
 			raise ValueError("Expected repository name of the form <project>/<repository>")
+		return project, repoName
+
+	def getCloneURL(self, name):
+		project, repoName = self.splitName(name)
 
 		if self.clone_url is not None:
 			return self.getCloneURLFromPattern(name)
@@ -190,6 +228,32 @@ class BitbucketHost(SubclassableHost, ActiveRecord):
 		else:
 			raise ValueError("No compatible clone links found")
 
+	def getDepsFile(self, name, revision = None, url = None):
+		if self.password is None:
+			return super().getDepsFile(name, revision, url)
+		project, repoName = self.splitName(name)
+		try:
+			resp = requests.get(f"{self.url}/rest/api/1.0/projects/{project}/repos/{repoName}/raw/deps.got", params = {'at': revision} if revision else None, auth = (self.username, self.password), timeout = self.REQUEST_TIMEOUT)
+		except requests.RequestException as e:
+			raise ConnectionError(str(e))
+		if resp.status_code == 404:
+			return None
+		if resp.status_code in (401, 403):
+			raise ConnectionError("Invalid/insufficient credentials")
+		if not resp.ok:
+			raise ConnectionError(f"Unable to read deps.got from {name}: HTTP {resp.status_code}")
+		return resp.text
+
+	def getRepoSize(self, name):
+		if self.password is None:
+			return None
+		project, repoName = self.splitName(name)
+		try:
+			resp = requests.get(f"{self.url}/projects/{project}/repos/{repoName}/sizes", auth = (self.username, self.password), timeout = self.REQUEST_TIMEOUT)
+			return int(resp.json()['repository']) if resp.ok else None
+		except (requests.RequestException, ValueError, KeyError):
+			return None
+
 	def getReposInProject(self, project):
 		if self.password is None:
 			raise RuntimeError(f"Unable to access Bitbucket API to query project repository list -- host `{self.name}' must be configured with a username/password")
@@ -214,13 +278,10 @@ class DaemonHost(SubclassableHost, ActiveRecord):
 		# Nothing stops 'name' from escaping the path specified by self.url, like '../../../foo'. I can't see a problem with allowing it other than that it's weird, and allowing normal subdirectory traversal could be useful, so not currently putting any restrictions on 'name'
 		rtn = f"{self.url}/{name}"
 		try:
-			oldEnv = dict(os.environ)
-			os.environ.update(makeGitEnvironment(self))
-			try:
-				git.Git().ls_remote(rtn)
-			finally:
-				os.environ.clear()
-				os.environ.update(oldEnv)
+			# Several repositories can be looked up at once on different threads, so this can't modify os.environ
+			g = git.Git()
+			with g.custom_environment(**makeGitEnvironment(self)):
+				g.ls_remote(rtn)
 		except git.GitCommandError as e:
 			err = e.stderr
 			# Try to strip off the formatting GitCommandError puts on stderr
@@ -0,0 +1,189 @@
+from .Clone import Clone
+from .DB import ActiveRecord, db
+from .RepoSpec import RepoSpec
+from .utils import gotRoot, verbose
+
+from git.util import RemoteProgress
+import hashlib
+import os
+from pathlib import Path
+import psutil
+import threading
+import time
+from typing import *
+
+try:
+	import fcntl
+except ImportError: # Windows
+	fcntl = None
+
+# How often (in seconds) the cloning process publishes its progress
+PUBLISH_INTERVAL = .25
+
+# Records of finished clones are only needed long enough for waiting processes to see them
+FINISHED_RETENTION = 60 * 60
+
+class InflightClone(ActiveRecord):
+	'''
+	A clone that some got process is currently making. Other processes that want the same repository wait on this instead of
+	looking up the host and queuing up on the repo lock, and get the result (or the error) as soon as the clone finishes.
+	The cloning process holds an exclusive lock on a lock file for the clone until it's done, and other processes block waiting for a shared lock on it. The OS wakes them
+	the moment it's released, including when the cloning process dies. Other threads of the cloning process are woken directly
+	'''
+
+	# The clones this process is making, so its own threads can wait on them without going through the database
+	local: Dict[str, 'InflightClone'] = {}
+	localLock = threading.Lock()
+
+	def __init__(self, key: str, pid: int, repospec: RepoSpec, path: Path, status: str, op: int = None, count: float = None, total: float = None, message: str = None, error: str = None, updated: float = None):
+		self.key = key
+		self.pid = pid
+		self.repospec = repospec if isinstance(repospec, RepoSpec) else RepoSpec.fromStr(repospec)
+		self.path = path if isinstance(path, Path) else Path(path)
+		self.status = status # cloning, done, failed
+		self.op = op
+		self.count = count
+		self.total = total
+		self.message = message
+		self.error = error
+		self.updated = updated if updated is not None else time.time()
+		self.changed = threading.Condition()
+		self.lockFile = None
+
+	@staticmethod
+	def lockPath(key: str) -> Path:
+		# Lock files are left in place afterwards; removing one could strand a waiter that already has it open
+		return gotRoot / 'inflight' / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.lock"
+
+	@staticmethod
+	def keyFor(repo: RepoSpec) -> str:
+		# This matches the name of the lock the cloning process holds (see RepoSpec.lock())
+		return repo.str(includeHost = False)
+
+	@classmethod
+	def start(cls, repo: RepoSpec, path: Path) -> 'InflightClone':
+		db.update("DELETE FROM inflight_clones WHERE status != 'cloning' AND updated < ?", time.time() - FINISHED_RETENTION)
+		rtn = cls(cls.keyFor(repo), os.getpid(), repo, path, 'cloning')
+		# The file lock is taken before the record is visible, so anyone who finds the record will wait on it
+		if fcntl is not None:
+			lockPath = cls.lockPath(rtn.key)
+			lockPath.parent.mkdir(parents = True, exist_ok = True)
+			rtn.lockFile = open(lockPath, 'a')
+			fcntl.flock(rtn.lockFile, fcntl.LOCK_EX)
+		rtn.save()
+		with cls.localLock:
+			cls.local[rtn.key] = rtn
+		return rtn
+
+	@classmethod
+	def find(cls, repo: RepoSpec) -> Optional['InflightClone']:
+		rtn = cls.tryLoad(key = cls.keyFor(repo), status = 'cloning')
+		if rtn is None or not psutil.pid_exists(rtn.pid):
+			return None
+		# The key leaves out the host, so make sure this is actually the requested repository
+		if repo.host is not None and rtn.repospec.host != repo.host:
+			return None
+		return rtn
+
+	def publish(self, op: int, count: Optional[float], total: Optional[float], message: Optional[str], force: bool = False):
+		now = time.time()
+		if not force and now - self.updated < PUBLISH_INTERVAL:
+			return
+		with self.changed:
+			self.op, self.count, self.total, self.message, self.updated = op, count, total, message, now
+			self.changed.notify_all()
+		db.update("UPDATE inflight_clones SET op = ?, count = ?, total = ?, message = ?, updated = ? WHERE key = ? AND pid = ?", op, count, total, message, now, self.key, self.pid)
+
+	def finish(self, error: Optional[str] = None):
+		self.error = error
+		self.updated = time.time()
+		self.status = 'done' if error is None else 'failed'
+		self.save()
+		if self.lockFile is not None:
+			fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+			self.lockFile.close()
+			self.lockFile = None
+		with self.localLock:
+			if InflightClone.local.get(self.key) is self:
+				del InflightClone.local[self.key]
+		with self.changed:
+			self.changed.notify_all()
+
+	def wait(self, progress: Optional[RemoteProgress] = None) -> Optional[Clone]:
+		# Returns the finished clone, or None if the cloning process went away without finishing (in which case the caller should clone it itself)
+		if verbose(1):
+			print(f"{self.repospec}: waiting for clone in progress (process {self.pid})")
+		with self.localLock:
+			owner = InflightClone.local.get(self.key) if self.pid == os.getpid() else None
+		cur = owner.waitLocal(progress) if owner is not None else self.waitRemote(progress)
+		if cur is None or cur.pid != self.pid:
+			return None
+		if cur.status == 'done':
+			return Clone(cur.repospec, cur.path)
+		if cur.status == 'failed':
+			raise RuntimeError(f"{cur.repospec}: clone in process {cur.pid} failed:\n{cur.error}")
+		# The cloning process let go of its lock without finishing, so it must have died
+		return None
+
+	def waitLocal(self, progress: Optional[RemoteProgress]) -> 'InflightClone':
+		# Waits for another thread of this process to finish the clone, passing its progress along as it's published
+		lastUpdate = None
+		with self.changed:
+			while self.status == 'cloning':
+				if progress is not None and self.op is not None and self.updated != lastUpdate:
+					progress.update(self.op, self.count, self.total, self.message)
+					lastUpdate = self.updated
+				self.changed.wait()
+		return self
+
+	def waitRemote(self, progress: Optional[RemoteProgress]) -> Optional['InflightClone']:
+		# Waits for another process to finish the clone by blocking on its lock file (see start()), then checks how the clone went.
+		# Meanwhile the clone's published progress is read from the database on another thread and passed along
+		lastUpdate = None
+		def showProgress():
+			nonlocal lastUpdate
+			cur = InflightClone.tryLoad(key = self.key)
+			if cur is not None and cur.op is not None and cur.updated != lastUpdate:
+				progress.update(cur.op, cur.count, cur.total, cur.message)
+				lastUpdate = cur.updated
+
+		if fcntl is None:
+			# Windows has no blocking lock that's released when its holder dies, so this queues up on the repo lock the cloning process holds (see RepoSpec.lock()),
+			# which is retried every second
+			with db.lock(f"repo.{self.key}", onWait = showProgress if progress is not None else None):
+				pass
+			return InflightClone.tryLoad(key = self.key)
+
+		done = threading.Event()
+		def reportProgress():
+			while not done.wait(PUBLISH_INTERVAL):
+				showProgress()
+		reporter = threading.Thread(target = reportProgress, daemon = True) if progress is not None else None
+		if reporter is not None:
+			reporter.start()
+		try:
+			with open(self.lockPath(self.key), 'a') as f:
+				fcntl.flock(f, fcntl.LOCK_SH)
+		finally:
+			done.set()
+			if reporter is not None:
+				reporter.join()
+		return InflightClone.tryLoad(key = self.key)
+
+class PublishingProgress(RemoteProgress):
+	'''Passes clone progress on to another progress handler (if there is one), and publishes it for processes waiting on the clone'''
+
+	def __init__(self, inflight: InflightClone, progress: Optional[RemoteProgress] = None):
+		super().__init__()
+		self.inflight = inflight
+		self.progress = progress
+
+	def update(self, opcode, count, max, msg = None):
+		if self.progress is not None:
+			self.progress.update(opcode, count, max, msg)
+		# Always publish the start and end of each phase, so waiters don't miss them to throttling
+		self.inflight.publish(opcode, count, max, msg, force = bool(opcode & self.STAGE_MASK))
+
+	def finish(self):
+		if self.progress is not None:
+			self.progress.finish()
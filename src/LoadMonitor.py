@@ -0,0 +1,46 @@
+import math
+import psutil
+import time
+from typing import *
+
+class LoadMonitor:
+	'''
+	Paces starting background processes (--run --bg) so the machine isn't oversubscribed. Every 'interval' seconds, CPU usage and available memory are sampled, and enough new processes
+	are admitted to use up the remaining headroom: one per idle CPU (rounding up) below the 'maxCpu' percent ceiling, and no more than fit in the available memory at 'jobMemory' bytes each.
+	'maxJobs' (if non-zero) is a hard limit on how many run at once. One process is always allowed when none are running, so progress is never blocked.
+	Processes started since the last sample have barely begun using CPU and memory, so the sample understates their load; they're counted against the headroom at their full share
+	'''
+
+	def __init__(self, maxCpu: float, jobMemory: int, maxJobs: int, interval: float = .5):
+		self.maxCpu = maxCpu
+		self.jobMemory = jobMemory
+		self.maxJobs = maxJobs
+		self.interval = interval
+		self.cpus = psutil.cpu_count() or 1
+		self.budget = 0
+		self.lastSample: Optional[float] = None
+		self.recentlyStarted = 0
+		# The first cpu_percent() call only starts the measurement
+		psutil.cpu_percent()
+
+	def headroom(self, running: int, recentlyStarted: int = 0) -> int:
+		# How many more processes can start now. 'recentlyStarted' of the running processes were started since the last sample, and are assumed to each need a whole CPU and 'jobMemory' bytes
+		cpu = psutil.cpu_percent()
+		# A partly idle CPU counts, or a machine with few CPUs would never run more than one process at a time below a ceiling under 100%
+		rtn = math.ceil(self.cpus * (self.maxCpu - cpu) / 100) - recentlyStarted
+		if self.jobMemory > 0:
+			rtn = min(rtn, (psutil.virtual_memory().available - self.jobMemory * recentlyStarted) // self.jobMemory)
+		if self.maxJobs > 0:
+			rtn = min(rtn, self.maxJobs - running)
+		return max(rtn, 1 if running == 0 else 0)
+
+	def waitForRoom(self, running: Callable[[], int]):
+		# Blocks until another process can start. 'running' returns how many are running now
+		while self.budget <= 0:
+			if self.lastSample is not None:
+				time.sleep(max(0, self.lastSample + self.interval - time.time()))
+			self.budget = self.headroom(running(), self.recentlyStarted)
+			self.lastSample = time.time()
+			self.recentlyStarted = 0
+		self.budget -= 1
+		self.recentlyStarted += 1
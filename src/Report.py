@@ -0,0 +1,100 @@
+from pathlib import Path
+import json
+import socket
+import subprocess
+import time
+from typing import *
+import xml.etree.ElementTree as ET
+
+class RepoResult:
+	'''
+	What happened to one repository during a multi-repository command. 'exit_code' is None if the command wasn't run, in which case 'error' says why (or 'skipped' is set).
+	'bytes_fetched' is how much the repository's object store grew, which covers anything cloned or fetched
+	'''
+
+	def __init__(self, repospec: str, path: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None, resolve_time: Optional[float] = None, exit_code: Optional[int] = None, error: Optional[str] = None, bytes_fetched: Optional[int] = None, skipped: bool = False, cached: bool = False):
+		self.repospec = str(repospec)
+		self.path = None if path is None else str(path)
+		self.start = start
+		self.end = end
+		self.resolve_time = resolve_time
+		self.exit_code = exit_code
+		self.error = error
+		self.bytes_fetched = bytes_fetched
+		self.skipped = skipped
+		self.cached = cached
+
+	@property
+	def duration(self) -> Optional[float]:
+		return None if self.start is None or self.end is None else self.end - self.start
+
+	@property
+	def failed(self) -> bool:
+		return not self.skipped and self.exit_code != 0
+
+	def toJSON(self) -> Dict[str, Any]:
+		return dict(vars(self), duration = self.duration)
+
+class Report:
+	'''
+	Per-repository timings and results of a --run, --git, or --where over several repositories, written by --report.
+	Files ending in .xml are written in JUnit's XML format, so CI systems can show them; anything else is JSON
+	'''
+
+	def __init__(self, command: str, existingClones: Iterable[str] = ()):
+		# existingClones: the paths of the clones that were registered when the command started, so anything cloned since can be counted in full
+		self.command = command
+		self.start = time.time()
+		self.results: List[RepoResult] = []
+		self.existingClones = set(existingClones)
+
+	@staticmethod
+	def objectStoreSize(clonePath: Path) -> Optional[int]:
+		# Size in bytes of the repository's objects, loose and packed
+		proc = subprocess.run(['git', '-C', str(clonePath), 'count-objects', '-v'], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True)
+		if proc.returncode != 0:
+			return None
+		fields = dict(line.split(': ', 1) for line in proc.stdout.splitlines() if ': ' in line)
+		return (int(fields.get('size', 0)) + int(fields.get('size-pack', 0))) * 1024
+
+	def sizeBefore(self, clonePath: Path) -> Optional[int]:
+		# The baseline for 'bytes_fetched', taken once the clone is resolved. A clone made since the command started had nothing before it
+		return self.objectStoreSize(clonePath) if str(clonePath) in self.existingClones else 0
+
+	def toJSON(self, end: float) -> str:
+		return json.dumps({
+			'command': self.command,
+			'start': self.start,
+			'end': end,
+			'duration': end - self.start,
+			'repos': [result.toJSON() for result in self.results],
+		}, indent = '\t')
+
+	def toJUnit(self, end: float) -> str:
+		suite = ET.Element('testsuite', {
+			'name': f"got --{self.command}",
+			'tests': str(len(self.results)),
+			'failures': str(sum(result.failed and result.exit_code is not None for result in self.results)),
+			'errors': str(sum(result.failed and result.exit_code is None for result in self.results)),
+			'skipped': str(sum(result.skipped for result in self.results)),
+			'time': f"{end - self.start:.3f}",
+			'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+			'hostname': socket.gethostname(),
+		})
+		for result in self.results:
+			case = ET.SubElement(suite, 'testcase', {'classname': f"got.{self.command}", 'name': result.repospec, 'time': f"{result.duration or 0:.3f}"})
+			if result.skipped:
+				ET.SubElement(case, 'skipped')
+			elif result.exit_code is None:
+				ET.SubElement(case, 'error', {'message': result.error or 'not run'})
+			elif result.exit_code != 0:
+				ET.SubElement(case, 'failure', {'message': f"exit code {result.exit_code}"})
+			properties = ET.SubElement(case, 'properties')
+			for name in ('path', 'resolve_time', 'bytes_fetched', 'cached'):
+				if getattr(result, name) is not None:
+					ET.SubElement(properties, 'property', {'name': name, 'value': str(getattr(result, name))})
+		return ET.tostring(suite, encoding = 'unicode')
+
+	def save(self, path: Path):
+		end = time.time()
+		path.write_text((self.toJUnit(end) if path.suffix.lower() == '.xml' else self.toJSON(end)) + '\n')
@@ -0,0 +1,68 @@
+from .Clone import Clone
+from .utils import gotRoot, porcelainStatus
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import *
+
+class RunCache:
+	'''
+	Results of successful --run invocations, one JSON file per entry in GOT_ROOT/run-cache. Entries are keyed on everything that could change a command's result:
+	the clone, its HEAD commit, the command line, and the values of the environment variables the user picked. Clones with any changes, including untracked files, are never cached.
+	An entry's modification time is when it was last used, for evict()
+	'''
+
+	dir = gotRoot / 'run-cache'
+
+	@staticmethod
+	def key(clone: Clone, cmd: Union[str, List[str]], envVars: Iterable[str]) -> Optional[str]:
+		# Returns None if the clone's state can't be cached
+		try:
+			branch, changed = porcelainStatus(clone.path, untracked = True)
+		except RuntimeError:
+			# Not a git repository
+			return None
+		if changed or branch.get('oid', '(initial)') == '(initial)':
+			return None
+		data = json.dumps([str(clone.path), branch['oid'], cmd, {var: os.environ.get(var) for var in sorted(envVars)}])
+		return hashlib.sha256(data.encode()).hexdigest()
+
+	@classmethod
+	def load(cls, key: str) -> Optional[Dict[str, Any]]:
+		path = cls.dir / f"{key}.json"
+		try:
+			rtn = json.loads(path.read_text())
+			os.utime(path)
+			return rtn
+		except (OSError, ValueError):
+			return None
+
+	@classmethod
+	def save(cls, key: str, output: Optional[str]):
+		cls.dir.mkdir(parents = True, exist_ok = True)
+		# Written to a temporary file first so a concurrent load() never sees a partial entry
+		fd, tempPath = tempfile.mkstemp(dir = str(cls.dir), suffix = '.tmp')
+		with os.fdopen(fd, 'w') as f:
+			json.dump({'exit_code': 0, 'output': output, 'created': time.time()}, f)
+		os.replace(tempPath, cls.dir / f"{key}.json")
+
+	@classmethod
+	def evict(cls, maxAge: float, maxSize: int):
+		# Removes entries that haven't been used in 'maxAge' seconds, and then the least recently used ones until the rest fit in 'maxSize' bytes
+		try:
+			entries = [(path, path.stat()) for path in cls.dir.glob('*.json')]
+		except OSError:
+			return
+		entries.sort(key = lambda entry: entry[1].st_mtime, reverse = True)
+		now, total = time.time(), 0
+		for path, stat in entries:
+			total += stat.st_size
+			if now - stat.st_mtime > maxAge or total > maxSize:
+				try:
+					path.unlink()
+				except FileNotFoundError:
+					pass
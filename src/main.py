@@ -1,4 +1,7 @@
 import argparse
+import collections
+import concurrent.futures
+import contextlib
 from getpass import getpass
 import git, gitdb
 import itertools
@@ -6,26 +9,40 @@ import json
 import os
 from pathlib import Path
 import platform
+import queue
 import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 from .DB import db, DB, Like
 from .Credential import Credential
 from .Config import config, DEFAULT_CONFIG, CONFIG_VALIDATORS
 from .Clone import Clone
+from .CatFile import CatFilePool
+from .Cloner import Cloner
+from .CloneStatus import CloneStatus
+from .DepGraph import DepGraph
+from .DepsFile import DepsFile
+from .DepsLock import DepsLock, LockedRepo
+from .FileWatcher import makeWatcher
 from .Host import Host
+from .InflightClone import InflightClone, PublishingProgress
+from .LoadMonitor import LoadMonitor
 
+from .Report import Report, RepoResult
 from .RepoSpec import RepoSpec, HOST_PATTERN
-from .utils import print_return, gotRoot, makeGitEnvironment, verbose, Template
+from .RunCache import RunCache
+from .utils import print_return, closeSshConnections, formatAge, formatSize, gotRoot, makeGitEnvironment, makeSshEnvironment, nullcontext, porcelainStatus, readHead, SHA_PATTERN, verbose, Template
 
 # Type hints
 from typing import *
 URL = NewType('URL', str)
 JSON = NewType('JSON', str)
+T = TypeVar('T')
 
 # On Windows, use the system certificates instead of the bundled ones
 if platform.system() == 'Windows' and 'REQUESTS_CA_BUNDLE' not in os.environ:
@@ -60,6 +77,8 @@ parser.add_argument('--unlock', action = DeprecatedAction, help = 'stale locks a
 # --verbose and --quiet are handled by the root script; they're included here so they show up in help output and don't cause argparse errors when present
 parser.add_argument('-v', '--verbose', action = 'count', default = None, help = 'increase the verbosity level')
 parser.add_argument('-q', '--quiet', action = 'store_const', dest = 'verbose', const = 0, help = "don't output verbose information to stderr (clear the verbosity level)")
+parser.add_argument('--progress-format', choices = ['rich', 'json'], default = 'rich', help = 'show clone/fetch progress as terminal progress bars, or write it as newline-delimited JSON events to --progress-fd')
+parser.add_argument('--progress-fd', type = int, default = 2, metavar = 'FD', help = 'file descriptor to write JSON progress events to (default: stderr)')
 
 modeGroup = parser.add_mutually_exclusive_group()
 def makeMode(name: str, handler: Callable, desc: Optional[str], aliases: List[str] = []) -> argparse.ArgumentParser:
@@ -136,9 +155,11 @@ def findRepo(repospec: RepoSpec) -> Tuple[Optional[Host], Optional[URL]]:
 			print(f"  {error}")
 	return None, None
 
-def where(repo: RepoSpec, format: str, on_uncloned: str, ensure_on_disk: bool = True, dest: str = None) -> Optional[Union[str, Clone, JSON]]:
+def where(repo: RepoSpec, format: str, on_uncloned: str, ensure_on_disk: bool = True, dest: str = None, dashboard: Optional['CloneDashboard'] = None, locked: Optional[LockedRepo] = None) -> Optional[Union[str, Clone, JSON]]:
 	# format: plain, py, json
 	# on_uncloned: clone, skip, fail, fake
+	# dashboard: if set, clone progress is shown as a row of this dashboard instead of on its own
+	# locked: if set, a new clone is made from the lockfile's URL (without looking the repo up on its host) and checked out at the locked commit
 	def formatRtn(clone: Clone) -> Union[str, Clone, JSON]:
 		if format == 'plain':
 			return str(clone.path)
@@ -186,8 +207,28 @@ def where(repo: RepoSpec, format: str, on_uncloned: str, ensure_on_disk: bool =
 		cloneRoot = repo.host.getEffectiveCloneRoot() if repo.host is not None else Path(config.clone_root)
 		return formatRtn(Clone(repo, cloneRoot / '__REPO_NOT_FOUND__'))
 
-	# If we don't have a matching clone, we need to find its host and clone it
-	host, url = findRepo(repo)
+	def makeProgress():
+		if dashboard is not None:
+			return dashboard.track(str(repo))
+		from .GitProgress import makeProgress
+		return makeProgress(str(repo))
+
+	# If another process is already cloning this repository, wait for it to finish instead of looking it up and cloning it again
+	if dest is None:
+		inflight = InflightClone.find(repo)
+		if inflight is not None:
+			progress = makeProgress()
+			with progress or nullcontext():
+				clone = inflight.wait(progress)
+			if clone is not None:
+				return formatRtn(clone)
+
+	# If we don't have a matching clone, we need to find its host and clone it. A lockfile entry already says where it lives
+	host = Host.tryLoad(name = locked.host) if locked is not None and locked.host is not None and locked.url is not None else None
+	if host is not None:
+		url = locked.url
+	else:
+		host, url = findRepo(repo)
 	if host is None:
 		raise RuntimeError(f"Unable to resolve repospec {repo}")
 	if repo.host is None:
@@ -212,64 +253,31 @@ def where(repo: RepoSpec, format: str, on_uncloned: str, ensure_on_disk: bool =
 		if verbose(1):
 			src = url if targetBranch is None else f"{url} ({targetBranch})"
 			print(f"Cloning {src} to {localPath}")
-		from .GitProgress import GitProgress
 
 		# There seems to be a GitPython bug that prevent this from working well: https://github.com/gitpython-developers/GitPython/issues/444#issuecomment-320523860
-		# In the meantime I just run git clone directly
+		# In the meantime I just run git directly
 		# git.Repo.clone_from(url, str(localPath), env = makeGitEnvironment(host), progress = GitProgress())
 
-		progress = GitProgress() if verbose(1) and sys.stdout.isatty() else None
+		progress = makeProgress()
 
 		env = dict(os.environ)
 		env.update(makeGitEnvironment(host))
 
-		class nullcontext:
-			def __enter__(self):
-				pass
-			def __exit__(self, *excinfo):
-				pass
-
-		with progress or nullcontext():
-			for _ in range(int(config.clone_retries) + 1):
-				proc = subprocess.Popen(['git', 'clone', '-v', '--progress', url, str(localPath)], env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
-				stderr = []
-				if progress is not None:
-					handler = progress.new_message_handler()
-					for line in proc.stderr:
-						stderr.append(line)
-						handler(line)
-					progress.finish()
-				else:
-					for line in proc.stderr:
-						stderr.append(line)
-				if proc.wait() == 0:
-					break
-				if verbose(2):
-					print("Clone failed (will retry):\n" + ''.join(stderr))
-				time.sleep(5)
-			else:
-				raise RuntimeError("Clone failed:\n" + ''.join(stderr))
-
-			if repo.revision is not None:
-				r = git.Repo(str(localPath))
-				try:
-					r.head.reference = r.commit(repo.revision)
-					r.head.reset(index = True, working_tree = True)
-				except gitdb.exc.BadName:
-					r.git.checkout(repo.revision, '--')
-			elif targetBranch is not None:
-				r = git.Repo(str(localPath))
-				try:
-					r.git.checkout(targetBranch, '--')
-				except git.exc.GitCommandError:
-					pass
+		inflight = InflightClone.start(repo, localPath)
+		try:
+			with progress or nullcontext():
+				Cloner(url, localPath, env, PublishingProgress(inflight, progress), locked.sha if locked is not None and locked.sha is not None else repo.revision, targetBranch).clone()
 
-		clone = Clone(repo, localPath)
-		clone.save()
+			clone = Clone(repo, localPath)
+			clone.save()
+		except Exception as e:
+			inflight.finish(str(e))
+			raise
+		inflight.finish()
 		return formatRtn(clone)
 
 # This is an adapter for command-line where mode. 'repos' comes from an argument of type 'multipart_repospec' with '+' nargs, so it's a list of lists of repospecs that needs to be flattened and passed to where() individually
-def whereCLI(repos: List[List[RepoSpec]], format: str, on_uncloned: str, dest: str, listen: bool, ignore_missing: bool):
+def whereCLI(repos: List[List[RepoSpec]], format: str, on_uncloned: str, dest: str, listen: bool, ignore_missing: bool, jobs: Optional[int], report: Optional[str] = None):
 	repos = [spec for l in repos for spec in l]
 	if not repos and not listen:
 		raise ValueError("One or more repospecs are required unless --listen is provided")
@@ -277,25 +285,124 @@ def whereCLI(repos: List[List[RepoSpec]], format: str, on_uncloned: str, dest: s
 		raise ValueError("Can't specify a clone destination with multiple repospecs or listen mode")
 
 	lookup = lambda repo: where(repo, format, on_uncloned, not ignore_missing, dest)
+	with reporting(report, 'where') as reportData:
+		results = lookupAll(repos, format, on_uncloned, ignore_missing, dest, jobs, reportData)
 
 	if format == 'json' and repos:
 		# JSON format is a list instead of multiple lines
-		yield json.dumps([json.loads(jsonObject) if jsonObject is not None else None for jsonObject in map(lookup, repos)])
+		yield json.dumps([json.loads(jsonObject) if jsonObject is not None else None for jsonObject in results])
 	else:
 		# In all other cases, print one line per repo
-		for repo in repos:
-			yield lookup(repo)
+		yield from results
 
 	if listen:
-		for spec in sys.stdin:
-			spec = spec.strip()
-			if spec:
-				# JSON format is a list instead of multiple lines
-				if format == 'json':
-					yield json.dumps([json.loads(jsonObject) if jsonObject is not None else None for jsonObject in map(lookup, type_multipart_repospec(spec))])
-				else:
-					for repo in type_multipart_repospec(spec):
-						yield lookup(repo)
+		yield from listenRequests(format, lookup, jobs or int(config.clone_jobs))
+
+def listenRequests(format: str, lookup: Callable[[RepoSpec], Optional[Union[str, JSON]]], jobs: int) -> Iterator[str]:
+	# Reads repospecs from stdin for --where --listen, and yields the lines to output.
+	# A plain 'spec' line is answered before the next line is read, and an error is fatal. An 'id<TAB>spec' line is a request: up to 'jobs' of them are resolved at once while stdin
+	# keeps being read, and each is answered as 'id<TAB>ok<TAB>answer' or 'id<TAB>error<TAB>message' as soon as it's done, so answers can come out of order.
+	# No more than 'jobs' clones run at once, across all the requests (including the traversals 'spec+' requests start)
+	responses: queue.Queue = queue.Queue()
+	finished = object()
+	Cloner.limit(jobs)
+
+	def answer(specs: Iterable[RepoSpec]) -> Optional[str]:
+		results = [lookup(repo) for repo in specs]
+		# JSON format is a list instead of multiple lines
+		if format == 'json':
+			return json.dumps([json.loads(jsonObject) if jsonObject is not None else None for jsonObject in results])
+		return '\n'.join(result for result in results if result is not None) or None
+
+	def request(id: str, spec: str) -> str:
+		try:
+			results = [lookup(repo) for repo in type_multipart_repospec(spec)]
+			if format == 'json':
+				return f"{id}\tok\t{json.dumps([json.loads(jsonObject) if jsonObject is not None else None for jsonObject in results])}"
+			# One field per repo, empty if it wasn't cloned
+			return '\t'.join([id, 'ok'] + [result or '' for result in results])
+		except Exception as e:
+			return f"{id}\terror\t{' '.join(str(e).split())}"
+
+	def read():
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers = jobs)
+		pending: Set[concurrent.futures.Future] = set()
+		def done(future: concurrent.futures.Future):
+			pending.discard(future)
+			if not future.cancelled():
+				responses.put(future.result())
+		try:
+			for line in sys.stdin:
+				line = line.strip(' \r\n')
+				if '\t' in line:
+					id, spec = line.split('\t', 1)
+					future = executor.submit(request, id, spec.strip())
+					pending.add(future)
+					future.add_done_callback(done)
+				elif line:
+					responses.put(answer(type_multipart_repospec(line)))
+		except BaseException as e:
+			# This is fatal, so it's reported right away instead of after the outstanding requests. The ones that haven't started yet never will
+			for future in list(pending):
+				future.cancel()
+			responses.put(e)
+		else:
+			# Every request is answered before the output ends
+			executor.shutdown()
+			responses.put(finished)
+		finally:
+			executor.shutdown(wait = False)
+
+	# Output all happens on this thread, one whole answer at a time
+	threading.Thread(target = read, daemon = True).start()
+	while True:
+		response = responses.get()
+		if response is finished:
+			return
+		if isinstance(response, BaseException):
+			raise response
+		if response is not None:
+			yield response
+
+def lookupAll(repos: List[RepoSpec], format: str, on_uncloned: str, ignore_missing: bool, dest: Optional[str], jobs: Optional[int], report: Optional[Report]) -> List[Optional[Union[str, JSON]]]:
+	# Resolves the command-line repos for --where. If 'report' is set, each lookup's timing and result are added to it
+	results = [RepoResult(repo) for repo in repos]
+	if report is not None:
+		report.results.extend(results)
+
+	def lookup(i: int, dashboard: Optional['CloneDashboard'] = None) -> Optional[Union[str, JSON]]:
+		repo, result = repos[i], results[i]
+		existing = next(Clone.loadSpec(repo), None) if report is not None else None
+		result.start = time.time()
+		try:
+			rtn = where(repo, format, on_uncloned, not ignore_missing, dest, dashboard)
+			result.exit_code = 0
+			return rtn
+		except Exception as e:
+			result.error = str(e)
+			raise
+		finally:
+			result.end = time.time()
+			result.resolve_time = result.duration
+			clone = (existing or next(Clone.loadSpec(repo), None)) if report is not None else None
+			if clone is not None:
+				result.repospec, result.path = str(clone.repospec), str(clone.path)
+				# Only a new clone fetched anything
+				if existing is None and clone.path.exists():
+					result.bytes_fetched = Report.objectStoreSize(clone.path)
+
+	if len(repos) > 1:
+		# Resolve all the command-line repos at once, showing any clones on a combined dashboard. The results are held until the dashboard is gone so they don't get drawn over
+		from . import GitProgress
+		dashboard = GitProgress.CloneDashboard(len(repos)) if GitProgress.progressFormat == 'rich' and verbose(1) and sys.stderr.isatty() else None
+		with dashboard or nullcontext():
+			with concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs)) as executor:
+				futures = [executor.submit(lookup, i, dashboard) for i in range(len(repos))]
+				if dashboard is not None:
+					for future in futures:
+						future.add_done_callback(lambda _: dashboard.advance())
+				return [future.result() for future in futures]
+	return [lookup(i) for i in range(len(repos))]
 
 def here(repo: RepoSpec, dir: str, force: bool) -> Optional[Clone]:
 	with repo.lock():
@@ -433,6 +540,55 @@ def showHosts(format: str) -> None:
 	elif format == 'json':
 		print(json.dumps({host.name: dict({k: getattr(host, k) for k in ('type', 'url', 'username', 'ssh_key_path', 'clone_url', 'clone_root')}, **{'effective_clone_root': str(host.getEffectiveCloneRoot())}) for host in Host.loadAll()}))
 
+def showStatus(repos: List[RepoSpec], format: str, jobs: Optional[int], no_cache: bool) -> None:
+	if repos:
+		clones = []
+		for repo in repos:
+			found = list(Clone.loadSpec(repo))
+			if not found:
+				raise ValueError(f"No clone of {repo} is registered")
+			clones.extend(found)
+	else:
+		clones = list(Clone.loadAll(sort = 'repospec ASC'))
+
+	def get(clone: Clone) -> JSON:
+		try:
+			return CloneStatus.get(clone.path, useCache = not no_cache)
+		except RuntimeError as e:
+			return {'error': str(e)}
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs)) as executor:
+		statuses = list(executor.map(get, clones))
+
+	if format == 'json':
+		print(json.dumps({str(clone.repospec): dict(status, path = str(clone.path)) for clone, status in zip(clones, statuses)}))
+		return
+	if not clones:
+		print("No clones registered")
+		return
+	rows = []
+	for clone, status in zip(clones, statuses):
+		if 'error' in status:
+			rows.append((str(clone.repospec), status['error']))
+			continue
+		if status['branch'] is not None:
+			branch = status['branch']
+		elif status['head'] is not None:
+			branch = f"(detached at {status['head'][:7]})"
+		else:
+			branch = '(no commits)'
+		if status['upstream'] is None:
+			sync = 'no upstream'
+		elif status['ahead'] or status['behind']:
+			sync = ', '.join(f"{k} {status[k]}" for k in ('ahead', 'behind') if status[k])
+		else:
+			sync = 'up to date'
+		fetched = 'never fetched' if status['last_fetch'] is None else f"fetched {formatAge(time.time() - status['last_fetch'])}"
+		rows.append((str(clone.repospec), branch, sync, 'dirty' if status['dirty'] else 'clean', fetched))
+	widths = [max((len(row[i]) for row in rows if i == 0 or len(row) > 2), default = 0) for i in range(4)]
+	for row in rows:
+		print('  '.join(col.ljust(width) for col, width in zip(row, widths + [0])).rstrip())
+
 def addHost(name: str, url: str, type: str, username: str, password: str, ssh_key: Optional[str], clone_url: Optional[str], clone_root: Optional[str], force: bool) -> None:
 	host = Host(name, type, url, username, ssh_key, clone_url, clone_root)
 	with host.lock():
@@ -524,6 +680,8 @@ def editHost(name: str, set_url: Optional[str], set_username: Optional[str], set
 					count += 1
 				print(f"Updated {count} clone remote {'URL' if count == 1 else 'URLs'}")
 			host.save()
+	# Shared SSH connections were made with the old settings
+	closeSshConnections(name)
 
 def rmHost(name: str) -> None:
 	with db.transaction():
@@ -535,60 +693,478 @@ def rmHost(name: str) -> None:
 		num = Clone.deleteAll(repospec = Like(name.replace('\\', '\\\\').replace('%', '\\%') + ':%'))
 		print(f"Removed host {name}")
 		print(f"Unregistered {num} {'clone' if num == 1 else 'clones'}")
+	closeSshConnections(name)
+
+def walkDeps(worklist: List[RepoSpec], resolve: Callable[[RepoSpec, bool], Tuple[T, Optional[List[RepoSpec]]]], jobs: Optional[int], hasRoot: bool, lateDeps: Optional[Callable[[T], Optional[List[RepoSpec]]]] = None) -> Iterable[Tuple[RepoSpec, T, Optional[List[RepoSpec]], bool]]:
+	# Breadth-first traversal of a dependency graph. 'resolve' is called on a worker thread for each repo as soon as the deps.got that lists it has been read, and returns some result along with the repo's dependencies (None if it has no dependencies file).
+	# The results are yielded as (repo, result, deps, isRoot) in the same breadth-first order a serial traversal would use, so the output is deterministic. If 'hasRoot', the first repo in the worklist is the one the user asked about.
+	# If 'lateDeps' is set, a repo's dependencies come from calling it on the result once the caller is done with it, instead of from 'resolve'
+	# 'seen' holds strings because where() fills in the host of the RepoSpecs it's given, which would change their hash
+	seen: Set[str] = set()
+	queue: Deque[Tuple[RepoSpec, concurrent.futures.Future]] = collections.deque()
+	with concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs)) as executor:
+		def enqueue(repos: Iterable[RepoSpec], isRoot: bool = False):
+			for repo in repos:
+				if str(repo) not in seen:
+					seen.add(str(repo))
+					queue.append((repo, executor.submit(resolve, repo, isRoot)))
 
-def iterDeps(repo: Optional[RepoSpec], on_uncloned: str = 'clone', startPath: Optional[Path] = None) -> Iterable[Clone]:
-	if startPath is None:
-		if repo is None:
-			try:
-				repo = what(None)
-			except RuntimeError:
-				print("Current directory is not a tracked repository")
-				return
-		worklist = [repo]
-	else:
-		worklist = [RepoSpec.fromStr(depSpec) for depSpec in startPath.read_text().split()]
+		try:
+			enqueue(worklist, hasRoot)
+			first = True
+			while queue:
+				repo, future = queue.popleft()
+				result, deps = future.result()
+				isRoot, first = first and hasRoot, False
+				yield repo, result, deps, isRoot
+				if lateDeps is not None:
+					deps = lateDeps(result)
+				if deps is not None:
+					enqueue(deps)
+		finally:
+			# If the caller stopped early (or something failed), don't bother resolving the rest
+			for _, future in queue:
+				future.cancel()
+
+def depsRoots(repo: Optional[RepoSpec], startPath: Optional[Path]) -> Optional[List[RepoSpec]]:
+	# The repos a dependency traversal starts from: 'repo' (defaulting to the current one), or the contents of 'startPath'
+	if startPath is not None:
+		return DepsFile.parse(startPath.read_text())
+	if repo is None:
+		try:
+			repo = what(None)
+		except RuntimeError:
+			print("Current directory is not a tracked repository")
+			return None
+	return [repo]
+
+def iterDeps(repo: Optional[RepoSpec], on_uncloned: str = 'clone', startPath: Optional[Path] = None, jobs: Optional[int] = None, useCache: bool = True, at: Optional[str] = None, useLock: bool = True, callerFirst: bool = False, visit: Optional[Callable[[Clone], T]] = None, resolveTimes: Optional[Dict[str, float]] = None) -> Iterable[Union[Clone, Tuple[Clone, T]]]:
+	# resolveTimes: if set, how long each clone took to look up (or clone) is stored in it, keyed by full repospec
+	# visit: if set, this is called on each clone on the worker thread that resolved it, before its deps.got is read (so changes it makes to deps.got are seen), and (clone, result) pairs are yielded instead of clones
+	# at: if set, the root repo's deps.got is read as of this revision, and pinned dependencies' deps.got files as of their pinned revisions, straight from the object database.
+	# A pinned dependency that isn't cloned (with on_uncloned = 'skip') is then read out of a clone of the same repo at another revision if there is one; it isn't yielded, but its dependencies are
+	# callerFirst: if set, each repo's deps.got isn't read until the caller is done with its clone and asks for the next one, so changes the caller makes to deps.got (e.g. by running 'git pull') are seen.
+	# Otherwise it's read on the worker thread right after the lookup, so the repo's dependencies start resolving sooner. This only matters when reading from the working tree
+	worklist = depsRoots(repo, startPath)
+	if worklist is None:
+		return
 
-	seen = set()
-	while worklist:
-		repo = worklist.pop(0)
-		if repo in seen:
-			continue
-		seen.add(repo)
+	# Parsed deps.got files are cached in the DB; the whole cache is loaded up front so unchanged files only cost a stat()
+	depsCache = DepsFile.loadCache() if useCache else None
+	catFiles = CatFilePool()
+
+	def readAt(path: Path, revision: str) -> Optional[List[RepoSpec]]:
+		catFile = catFiles.forRepo(path)
+		if not catFile.hasCommit(revision):
+			raise RuntimeError(f"{path}: unknown revision {revision}")
+		data = catFile.read(revision, 'deps.got')
+		return DepsFile.parse(data.decode()) if data is not None else None
+
+	def resolve(repo: RepoSpec, isRoot: bool) -> Tuple[Tuple[Optional[Clone], Optional[T]], Optional[List[RepoSpec]]]:
+		start = time.time()
 		clone: Clone = where(repo, 'py', on_uncloned)
+		if resolveTimes is not None and clone is not None:
+			resolveTimes[str(clone.repospec)] = time.time() - start
+		revision = (at if isRoot else repo.revision) if at is not None else None
 		if clone is None:
-			continue
+			if revision is not None:
+				mirror = where(RepoSpec(repo.name, None, repo.host), 'py', 'skip')
+				if mirror is not None and catFiles.forRepo(Path(mirror.path)).hasCommit(revision):
+					return (None, None), readAt(Path(mirror.path), revision)
+			return (None, None), None
+		visited = visit(clone) if visit is not None else None
+		if revision is not None:
+			return (clone, visited), readAt(Path(clone.path), revision)
+		if callerFirst:
+			return (clone, visited), None
+		return (clone, visited), DepsFile.read(Path(clone.path), depsCache)
+
+	def readLate(result: Tuple[Optional[Clone], Optional[T]]) -> Optional[List[RepoSpec]]:
+		clone, _ = result
+		return DepsFile.read(Path(clone.path), depsCache) if clone is not None else None
+
+	late = callerFirst and at is None
+	walker = walkDeps(worklist, resolve, jobs, startPath is None, readLate if late else None)
+	lock = None
+	try:
+		for repo, (clone, visited), deps, isRoot in walker:
+			if clone is not None:
+				yield (clone, visited) if visit is not None else clone
+			if isRoot and clone is not None and useLock and at is None:
+				# This is checked after the root has been yielded, in case the caller changed its deps.got
+				lock = DepsLock.load(Path(clone.path))
+				if lock is not None and lock.isValid(Path(clone.path)):
+					break
+				lock = None
+			# If 'late', deps.got hasn't been read yet
+			hasDeps = (Path(clone.path) / 'deps.got').exists() if late and clone is not None else deps is not None
+			if not hasDeps and isRoot and clone is not None: # This is the first repo, the one the user specified
+				print(f"{repo} has no dependencies file ({Path(clone.path) / 'deps.got'})" + (f" at {at}" if at is not None else ''))
+	finally:
+		walker.close()
+		catFiles.close()
+	if lock is not None:
+		yield from iterLockedDeps(lock, on_uncloned, jobs, visit)
+
+def iterLockedDeps(lock: DepsLock, on_uncloned: str, jobs: Optional[int], visit: Optional[Callable[[Clone], T]] = None) -> Iterable[Union[Clone, Tuple[Clone, T]]]:
+	# Resolves every repo in a lockfile at once, since there are no deps.got files to wait on. The clones are yielded in the lockfile's order
+	def resolve(locked: LockedRepo) -> Tuple[Optional[Clone], Optional[T]]:
+		clone = where(locked.repospec, 'py', on_uncloned, locked = locked)
+		if clone is not None and locked.sha is not None:
+			try:
+				head = git.Repo(str(clone.path)).head.commit.hexsha
+			except (git.exc.InvalidGitRepositoryError, ValueError):
+				head = None
+			# Existing clones are never moved, since that could throw away the user's work, but they shouldn't silently differ from the lockfile either
+			if head != locked.sha:
+				print(f"Warning: {locked.repospec}: checked out at {head[:7] if head else 'no commit'}, but locked at {locked.sha[:7]}", file = sys.stderr)
+		return clone, (visit(clone) if visit is not None and clone is not None else None)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs)) as executor:
+		futures = [executor.submit(resolve, locked) for locked in lock.repos]
+		try:
+			for future in futures:
+				clone, visited = future.result()
+				if clone is not None:
+					yield (clone, visited) if visit is not None else clone
+		finally:
+			for future in futures:
+				future.cancel()
+
+def lockDeps(repo: Optional[RepoSpec], on_uncloned: str, jobs: Optional[int], useCache: bool) -> None:
+	# Resolves the dependency graph the usual way and writes the result to the root repo's deps.lock
+	clones = list(iterDeps(repo, on_uncloned, None, jobs, useCache, useLock = False))
+	if not clones:
+		return
+	root, deps = clones[0], clones[1:]
+	locked = []
+	for clone in deps:
+		try:
+			r = git.Repo(str(clone.path))
+			url = r.remotes['origin'].url if 'origin' in r.remotes else None
+			try:
+				sha = r.head.commit.hexsha
+			except ValueError: # No commits
+				sha = None
+		except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+			url = sha = None
+		locked.append(LockedRepo(clone.repospec, clone.repospec.host, url, sha))
+	DepsLock(DepsLock.hashDepsFile(root.path), locked).save(root.path)
+	print(f"Locked {len(locked)} {'dependency' if len(locked) == 1 else 'dependencies'} in {root.path / 'deps.lock'}")
+
+def depsGraph(repo: Optional[RepoSpec], on_uncloned: str = 'clone', startPath: Optional[Path] = None, jobs: Optional[int] = None, useCache: bool = True) -> DepGraph:
+	# Walks the dependency graph like iterDeps(), but keeps the edges. Dependencies that aren't resolved (e.g. with on_uncloned = 'skip') are left out of the graph
+	worklist = depsRoots(repo, startPath)
+	graph = DepGraph()
+	if worklist is None:
+		return graph
+	depsCache = DepsFile.loadCache() if useCache else None
+
+	def resolve(repo: RepoSpec, isRoot: bool) -> Tuple[Tuple[str, Optional[Clone], List[str]], Optional[List[RepoSpec]]]:
+		# Dependencies are identified by how they're written in deps.got, which might not include the host. Record that before where() fills it in
+		key = str(repo)
+		clone: Clone = where(repo, 'py', on_uncloned)
+		deps = DepsFile.read(Path(clone.path), depsCache) if clone is not None else None
+		return (key, clone, [str(dep) for dep in deps or []]), deps
+
+	nodes = [result for _, result, _, _ in walkDeps(worklist, resolve, jobs, startPath is None)]
+	canonical = {key: str(clone.repospec) for key, clone, _ in nodes if clone is not None}
+	for key, clone, deps in nodes:
+		if clone is not None:
+			graph.addNode(clone, [canonical[dep] for dep in deps if dep in canonical])
+	return graph
+
+def watchDeps(repo: Optional[RepoSpec], on_uncloned: str, jobs: Optional[int]) -> Iterable[JSON]:
+	# Outputs the dependency closure as 'add' events, then watches each clone's deps.got (and the clone registry) and outputs 'add' and 'remove' events as the closure changes, until the caller stops iterating.
+	# Only the deps.got files that actually changed are reread, and new dependencies are resolved (and cloned, if necessary) in the background
+	worklist = depsRoots(repo, None)
+	if worklist is None:
+		return
+	# Repos are keyed by how they're written in deps.got, like in depsGraph()
+	rootKey = str(worklist[0])
+	specs: Dict[str, RepoSpec] = {rootKey: worklist[0]}
+	clones: Dict[str, Optional[Clone]] = {} # None if the repo couldn't be resolved
+	edges: Dict[str, List[str]] = {}
+	pending: Dict[str, concurrent.futures.Future] = {}
+	closure: Dict[str, Clone] = {} # The closure as of the last events, keyed by full repospec
+
+	def event(kind: str, **fields) -> JSON:
+		return json.dumps({'event': kind, **fields})
+
+	def readDeps(clone: Clone) -> List[RepoSpec]:
+		try:
+			return DepsFile.parse((Path(clone.path) / 'deps.got').read_text())
+		except FileNotFoundError:
+			return []
+
+	def resolve(spec: RepoSpec) -> Tuple[Optional[Clone], List[RepoSpec]]:
+		# where() fills in the host of the spec it's given, so give it a copy
+		clone = where(RepoSpec(spec.name, spec.revision, spec.host), 'py', on_uncloned)
+		return clone, (readDeps(clone) if clone is not None else [])
+
+	def setDeps(key: str, deps: List[RepoSpec]):
+		for dep in deps:
+			specs.setdefault(str(dep), dep)
+		edges[key] = [str(dep) for dep in deps]
+
+	def update() -> Iterable[JSON]:
+		# Starts resolving anything that's newly reachable, and reports how the closure changed
+		nonlocal closure
+		reachable, seen = [], {rootKey}
+		queue = collections.deque([rootKey])
+		while queue:
+			key = queue.popleft()
+			reachable.append(key)
+			if clones.get(key) is not None:
+				for dep in edges.get(key, []):
+					if dep not in seen:
+						seen.add(dep)
+						queue.append(dep)
+		for key in reachable:
+			if key not in clones and key not in pending:
+				pending[key] = executor.submit(resolve, specs[key])
+
+		newClosure = {str(clones[key].repospec): clones[key] for key in reachable if clones.get(key) is not None}
+		for name, clone in newClosure.items():
+			if name not in closure:
+				watcher.watch(Path(clone.path) / 'deps.got')
+				yield event('add', repospec = name, path = str(clone.path))
+		for name, clone in closure.items():
+			if name not in newClosure:
+				watcher.unwatch(Path(clone.path) / 'deps.got')
+				# Its deps.got isn't watched anymore, so forget about it; it'll be resolved again if it comes back
+				for key in [key for key, c in clones.items() if c is not None and str(c.repospec) == name]:
+					del clones[key]
+				yield event('remove', repospec = name, path = str(clone.path))
+		closure = newClosure
+
+	watcher = makeWatcher()
+	watcher.watch(db.path)
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs))
+	registryChanged, lastRegistryCheck = False, 0
+	try:
+		yield from update()
+		while True:
+			changed = watcher.wait(.2)
+			if changed:
+				# Files are often written in more than one step (e.g. truncated and then filled in), so wait for them to settle before reading them
+				while True:
+					more = watcher.wait(.05)
+					if not more:
+						break
+					changed |= more
 
-		yield clone
+			for key, future in list(pending.items()):
+				if future.done():
+					del pending[key]
+					try:
+						clone, deps = future.result()
+					except Exception as e:
+						clone, deps = None, []
+						yield event('error', repospec = key, message = str(e))
+					clones[key] = clone
+					if clone is not None:
+						setDeps(key, deps)
+
+			# Registry changes can mean repos were cloned or removed. got itself writes to the registry a lot, so this is rechecked at most once a second
+			registryChanged = registryChanged or db.path in changed
+			if registryChanged and time.time() - lastRegistryCheck >= 1:
+				registryChanged, lastRegistryCheck = False, time.time()
+				for key, clone in list(clones.items()):
+					current = where(RepoSpec(specs[key].name, specs[key].revision, specs[key].host), 'py', 'skip')
+					if current is None and clone is not None:
+						del clones[key]
+					elif current is not None and (clone is None or current.path != clone.path):
+						clones[key] = current
+						try:
+							setDeps(key, readDeps(current))
+						except ValueError as e:
+							yield event('error', repospec = str(current.repospec), message = str(e))
+
+			for path in changed:
+				for key, clone in clones.items():
+					if clone is not None and Path(clone.path) / 'deps.got' == path:
+						try:
+							setDeps(key, readDeps(clone))
+						except ValueError as e:
+							yield event('error', repospec = str(clone.repospec), message = str(e))
+			yield from update()
+	finally:
+		executor.shutdown(wait = False)
+		watcher.close()
+
+def planDeps(repo: Optional[RepoSpec], startPath: Optional[Path] = None, jobs: Optional[int] = None) -> Iterable[Tuple[RepoSpec, Optional[Clone], Optional[int]]]:
+	# Walks the whole dependency graph without cloning anything: repos that aren't cloned have their deps.got read straight from their host.
+	# Yields (repo, clone, size), where 'clone' is None for repos that would need to be cloned, and 'size' is their size in bytes if the host can tell
+	worklist = depsRoots(repo, startPath)
+	if worklist is None:
+		return
+	depsCache = DepsFile.loadCache()
+
+	def resolve(repo: RepoSpec, isRoot: bool) -> Tuple[Tuple[Optional[Clone], Optional[int]], Optional[List[RepoSpec]]]:
+		clone: Clone = where(repo, 'py', 'skip')
+		if clone is not None:
+			return (clone, None), DepsFile.read(Path(clone.path), depsCache)
+		host, url = findRepo(repo)
+		if host is None:
+			raise RuntimeError(f"Unable to resolve repospec {repo}")
+		if repo.host is None:
+			repo.host = host.name
+		text = host.getDepsFile(repo.name, repo.revision, url)
+		return (None, host.getRepoSize(repo.name)), (DepsFile.parse(text) if text is not None else None)
 
-		depsPath = Path(clone.path) / 'deps.got'
-		if depsPath.exists():
-			worklist += [RepoSpec.fromStr(depSpec) for depSpec in depsPath.read_text().split() if depSpec not in seen]
-		elif len(seen) == 1 and startPath is None: # This is the first repo, the one the user specified
-			print(f"{repo} has no dependencies file ({depsPath})")
+	for repo, (clone, size), _, _ in walkDeps(worklist, resolve, jobs, startPath is None):
+		yield repo, clone, size
 
-def deps(repo: Optional[RepoSpec], format: str, file: Optional[str], on_uncloned: str) -> Iterable[str]:
+def deps(repo: Optional[RepoSpec], format: str, file: Optional[str], on_uncloned: str, jobs: Optional[int], no_cache: bool, at: Optional[str], plan: bool, apply: bool, lock: bool, no_lock: bool, format_graph: Optional[str], snapshot: Optional[str], changed_since: Optional[str], watch: bool) -> Iterable[str]:
 	if file is not None:
 		file = Path(file)
 		if not file.exists():
 			raise ValueError(f"Dependency file does not exist: {file}")
+	if watch:
+		if file is not None or at is not None or plan or apply or lock or format_graph is not None or snapshot is not None or changed_since is not None:
+			raise ValueError("--watch can't be combined with other --deps modes")
+		try:
+			yield from watchDeps(repo, on_uncloned, jobs)
+		except KeyboardInterrupt: # This is how --watch is meant to be stopped, so it isn't an error
+			pass
+		return
+
+	if format_graph is not None:
+		if at is not None or plan or apply or lock:
+			raise ValueError("--format-graph can't be combined with --at, --plan, or --lock")
+		graph = depsGraph(repo, on_uncloned, file, jobs, not no_cache)
+		yield graph.toJSON() if format_graph == 'json' else graph.toDot()
+		return
+
+	if lock:
+		if file is not None or at is not None or plan or apply:
+			raise ValueError("--lock can't be combined with --file, --at, or --plan")
+		lockDeps(repo, on_uncloned, jobs, not no_cache)
+		return
+
+	if plan or apply:
+		if at is not None:
+			raise ValueError("--plan can't be combined with --at")
+		missing = []
+		totalSize, unknownSizes = 0, 0
+		for dep, clone, size in planDeps(repo, file, jobs):
+			if clone is not None:
+				yield f"{dep}\tcloned\t{clone.path}"
+				continue
+			missing.append(dep)
+			if size is None:
+				unknownSizes += 1
+			else:
+				totalSize += size
+			yield f"{dep}\tclone\t{formatSize(size) if size is not None else 'unknown size'}"
+		print(f"{len(missing)} {'repository' if len(missing) == 1 else 'repositories'} to clone ({formatSize(totalSize)}" + (f", plus {unknownSizes} of unknown size)" if unknownSizes else ')'))
+		if apply and missing:
+			for _ in whereCLI([missing], 'plain', 'clone', None, False, False, jobs):
+				pass
+		return
+
+	# Only the fields the format actually uses are computed
 	t = Template(format)
-	for clone in iterDeps(repo, on_uncloned, file):
+	fields = t.fields()
+	unknown = fields - {'H', 'h', 'RS', 'rs', 'p'}
+	if unknown:
+		raise ValueError("Invalid format string specifier: %s" % ', '.join(sorted(unknown)))
+
+	def headOf(clone: Clone) -> str:
+		hexsha = readHead(clone.path)
+		if hexsha is None:
+			try:
+				hexsha = git.Repo(str(clone.path)).head.commit.hexsha
+			except:
+				hexsha = '0' * 40
+		return hexsha
+
+	def formatClone(clone: Clone, hexsha: Optional[str]) -> str:
+		values = {'p': lambda: str(clone.path), 'RS': lambda: clone.repospec.str(), 'rs': lambda: clone.repospec.str(False, False), 'H': lambda: hexsha, 'h': lambda: hexsha[:7]}
+		return t.substitute({field: values[field]() for field in fields})
+
+	def isDirty(clone: Clone) -> bool:
+		# Only changes to tracked files count, as with checkPinnedClone; build output and other untracked files don't make a repo "changed"
 		try:
-			hexsha = git.Repo(str(clone.path)).head.commit.hexsha
-		except:
-			hexsha = '0' * 40
+			_, changed = porcelainStatus(clone.path)
+		except RuntimeError:
+			return False
+		return changed
+
+	# The recorded HEADs to compare against, keyed by full repospec
+	snapshotHeads = None
+	if changed_since is not None:
 		try:
-			yield t.substitute(
-				H = hexsha,
-				h = hexsha[:7],
-				RS = clone.repospec.str(),
-				rs = clone.repospec.str(False, False),
-				p = str(clone.path),
-			)
-		except KeyError as e:
-			raise ValueError("Invalid format string specifier: %s" % e)
-
-def gitPassthrough(directory: Optional[str], ignore_errors: bool, args: List[str]) -> None:
+			snapshotHeads = json.loads(Path(changed_since).read_text())['heads']
+		except (OSError, ValueError, KeyError) as e:
+			raise ValueError(f"Unable to read snapshot {changed_since}: {e}")
+
+	def headAndChanged(clone: Clone) -> Tuple[str, bool]:
+		hexsha = headOf(clone)
+		changed = snapshotHeads is not None and (snapshotHeads.get(str(clone.repospec)) != hexsha or isDirty(clone))
+		return hexsha, changed
+
+	needHead = bool(fields & {'H', 'h'}) or snapshot is not None or snapshotHeads is not None
+	if needHead:
+		# The HEADs are read (and changes checked for) by iterDeps' worker threads as each clone is resolved, in case some of them need to fall back to GitPython or run git.
+		# The results still stream out in traversal order
+		results = ((clone, hexsha, changed) for clone, (hexsha, changed) in iterDeps(repo, on_uncloned, file, jobs, not no_cache, at, not no_lock, visit = headAndChanged))
+	else:
+		results = ((clone, None, False) for clone in iterDeps(repo, on_uncloned, file, jobs, not no_cache, at, not no_lock))
+
+	if snapshot is not None:
+		heads = {str(clone.repospec): hexsha for clone, hexsha, _ in results}
+		Path(snapshot).write_text(json.dumps({'heads': heads}, indent = '\t') + '\n')
+		print(f"Recorded {len(heads)} {'repository' if len(heads) == 1 else 'repositories'} in {snapshot}")
+		return
+	for clone, hexsha, changed in results:
+		if snapshotHeads is None or changed:
+			yield formatClone(clone, hexsha)
+
+def checkPinnedClone(clone: Clone) -> Optional[str]:
+	# Returns what's wrong with a version-pinned clone, or None if it's clean and at its pinned revision. This is one 'git status' (plus a 'git rev-parse' if the revision isn't a full SHA),
+	# which is much faster on big repos than comparing the index and working tree through GitPython
+	branch, changed = porcelainStatus(clone.path)
+	if changed:
+		return f"{clone.repospec}: Unexpected changes in version-pinned repository"
+	head = branch.get('oid')
+
+	revision = clone.repospec.revision
+	if not SHA_PATTERN.match(revision):
+		proc = subprocess.run(['git', '-C', str(clone.path), 'rev-parse', '--verify', '-q', f"{revision}^{{commit}}"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True)
+		revision = proc.stdout.strip()
+	if head != revision:
+		return f"{clone.repospec}: Wrong HEAD in version-pinned repository"
+	return None
+
+def fetchPinned(repo: git.Repo, revision: str, progress: Optional[git.RemoteProgress]) -> str:
+	# Makes sure a version-pinned clone has its pinned revision, with as little network traffic as possible, and returns what to reset HEAD to.
+	# A commit that's already present can't have changed, so there's nothing to fetch. Otherwise only the pinned revision is fetched, instead of every ref on the remote
+	if SHA_PATTERN.match(revision):
+		try:
+			repo.git.cat_file('-e', f"{revision}^{{commit}}")
+			return revision
+		except git.exc.GitCommandError:
+			pass
+
+	with progress or nullcontext():
+		try:
+			repo.remotes['origin'].fetch(revision, progress = progress)
+		except git.exc.GitCommandError:
+			if not SHA_PATTERN.match(revision):
+				raise
+			# Not every server lets clients ask for a commit by SHA; fall back to fetching everything
+			repo.remotes['origin'].fetch(progress = progress)
+			return revision
+	try:
+		repo.commit(revision)
+		return revision
+	except gitdb.exc.BadName:
+		# A tag or remote branch that wasn't stored under its own name
+		return 'FETCH_HEAD'
+
+def gitPassthrough(directory: Optional[str], ignore_errors: bool, jobs: Optional[int], stream: bool, report: Optional[str], args: List[str]) -> None:
 	if not args:
 		raise ValueError("No git command specified")
 	command, args = args[0], args[1:]
@@ -603,37 +1179,109 @@ def gitPassthrough(directory: Optional[str], ignore_errors: bool, args: List[str
 	# Figure out the root repo
 	rootRepo = what(directory)
 
-	# Iterate over the root repo and its dependencies
-	failed = 0
-	for clone in iterDeps(rootRepo):
-		repo = git.Repo(str(clone.path))
-		if clone.repospec.revision and repo.index.diff(None):
-			print(f"{clone.repospec}: Unexpected changes in version-pinned repository")
-		elif clone.repospec.revision and repo.commit(clone.repospec.revision) != repo.head.commit:
-			print(f"{clone.repospec}: Wrong HEAD in version-pinned repository")
+	# By default the command runs on one repo at a time, in traversal order, on this thread (commands like 'commit' can be interactive). Dependencies are still looked up and cloned in parallel.
+	# With 'jobs', it runs on iterDeps' worker threads as the repos are resolved, up to 'jobs' at once. Unless 'ignore_errors' is set, no new repos are started after one fails
+	slots = threading.Semaphore(jobs or 1)
+	stopping = threading.Event()
+	printLock = threading.Lock()
+	from . import GitProgress
+
+	def run(clone: Clone) -> Tuple[str, Optional[Exception], RepoResult]:
+		# Runs the command on one repo. Returns its output (unless it was streamed), the error if it failed, and its timings
+		output = []
+		def emit(text: str, prefix: bool = True):
+			if stream:
+				with printLock:
+					for line in text.split('\n'):
+						print(f"{clone.repospec}: {line}" if prefix else line, flush = True)
+			else:
+				output.append(text)
+
+		with slots:
+			if stopping.is_set():
+				return '', None, RepoResult(clone.repospec, clone.path, skipped = True)
+			result = RepoResult(clone.repospec, clone.path, time.time(), exit_code = 0)
+			sizeBefore = reportData.sizeBefore(clone.path) if reportData is not None else None
+			def finish(error: Optional[git.exc.GitCommandError]) -> RepoResult:
+				result.end = time.time()
+				if error is not None:
+					result.exit_code = error.status if isinstance(error.status, int) else None
+					result.error = str(error)
+				if sizeBefore is not None:
+					sizeAfter = Report.objectStoreSize(clone.path)
+					result.bytes_fetched = sizeAfter - sizeBefore if sizeAfter is not None else None
+				return result
+
+			problem = checkPinnedClone(clone) if clone.repospec.revision else None
+			if problem is not None:
+				# The message already starts with the repospec
+				emit(problem, prefix = False)
+			elif not stream:
+				emit(str(clone.repospec))
+			repo = git.Repo(str(clone.path))
+			host = Host.load(name = clone.repospec.host)
+			error = None
+			with repo.git.custom_environment(**makeGitEnvironment(host)):
+				try:
+					if clone.repospec.revision and pinnedBehavior != 'normal':
+						if pinnedBehavior == 'reset':
+							# Progress bars from several repos at once would draw over each other
+							progress = GitProgress.makeProgress(str(clone.repospec)) if (jobs or 1) == 1 or GitProgress.progressFormat == 'json' else None
+							repo.head.reset(fetchPinned(repo, clone.repospec.revision, progress), hard = True)
+						return '\n'.join(output), None, finish(None)
+					text = getattr(repo.git, command)(*args)
+					if text or not stream:
+						emit(text)
+				except git.exc.GitCommandError as e:
+					error = e
+					if ignore_errors:
+						emit(f"Ignored error: {e}")
+					else:
+						stopping.set()
+				finally:
+					repo.close()
+			if not stream:
+				output.append('')
+			return '\n'.join(output), error, finish(error)
+
+	# Iterate over the root repo and its dependencies. Output is printed in traversal order no matter which repo finishes first
+	failures = []
+	timings = []
+	startTime = time.time()
+	resolveTimes = {}
+	with reporting(report, 'git') as reportData:
+		if jobs is None:
+			# Each repo's deps.got is read after the command has run on it, so commands that change it (like 'checkout') affect which dependencies come next
+			results = ((clone, run(clone)) for clone in iterDeps(rootRepo, callerFirst = True, resolveTimes = resolveTimes))
 		else:
-			print(clone.repospec)
-		host = Host.load(name = clone.repospec.host)
-		with repo.git.custom_environment(**makeGitEnvironment(host)):
-			try:
-				if clone.repospec.revision:
-					if pinnedBehavior == 'skip':
-						continue
-					elif pinnedBehavior == 'reset':
-						repo.remotes['origin'].fetch()
-						repo.head.reset(clone.repospec.revision, hard = True)
-						continue
-				print(getattr(repo.git, command)(*args))
-			except git.exc.GitCommandError as e:
-				if ignore_errors:
-					failed += 1
-					print(f"Ignored error: {e}")
-				else:
-					raise e
-			print()
-
-	if failed:
-		print(f"Command failed on {failed} {'repository' if failed == 1 else 'repositories'}")
+			# The commands run on the traversal's worker pool, so it needs at least 'jobs' threads
+			results = iterDeps(rootRepo, jobs = max(jobs, int(config.clone_jobs)), visit = run, resolveTimes = resolveTimes)
+		for clone, (output, error, result) in results:
+			if result.skipped:
+				if reportData is not None:
+					reportData.results.append(result)
+				continue
+			if output:
+				print(output, flush = True)
+			timings.append((clone.repospec, result.duration))
+			result.resolve_time = resolveTimes.get(str(clone.repospec))
+			if reportData is not None:
+				reportData.results.append(result)
+			if error is not None:
+				if not ignore_errors:
+					raise error
+				failures.append(clone.repospec)
+
+	if failures:
+		print(f"Command failed on {len(failures)} {'repository' if len(failures) == 1 else 'repositories'}")
+	if verbose(1):
+		# The summary goes to stderr so it doesn't get mixed up with git's output
+		slowest = sorted(timings, key = lambda t: t[1], reverse = True)[:5]
+		print(f"Ran git {command} on {len(timings)} {'repository' if len(timings) == 1 else 'repositories'} in {time.time() - startTime:.1f}s", file = sys.stderr)
+		if len(timings) > 1:
+			print("Slowest: " + ', '.join(f"{repospec} ({duration:.1f}s)" for repospec, duration in slowest), file = sys.stderr)
+		if failures:
+			print("Failed: " + ', '.join(map(str, failures)), file = sys.stderr)
 
 def configCLI(key: Optional[str], value: Optional[str]) -> None:
 	if key is None:
@@ -760,32 +1408,271 @@ def scan(dirs: Iterable[str], interactive: bool) -> None:
 	print()
 	print(f"Scan complete. Added {added} {'clone' if added == 1 else 'clones'}")
 
-def run(repos: Iterable[Iterable[RepoSpec]], cmd: List[str], bg: bool, ignore_errors: bool):
+def runEnvironment(clone: Clone) -> Dict[str, str]:
 	env = dict(os.environ)
-	procs = []
-	for set in repos:
-		for repo in set:
-			clone: Clone = where(repo, 'py', 'clone')
-			print(str(clone.repospec), file = sys.stderr)
-			env['GOT_REPOSPEC'] = str(clone.repospec)
-
-			if platform.system() == 'Windows':
-				# Passing a whole command as a single string inside a list won't work on Windows, e.g. -x 'foo bar baz'. Turn it into a raw string instead
-				shell = True
-				if len(cmd) == 1:
-					cmd = cmd[0]
+	env['GOT_REPOSPEC'] = str(clone.repospec)
+	# Let git commands in the repo share got's SSH connections to its host
+	host = Host.tryLoad(name = clone.repospec.host) if clone.repospec.host else None
+	if host is not None:
+		env.update(makeSshEnvironment(host))
+	return env
+
+def runDependencies(repos: List[RepoSpec], jobs: Optional[int] = None, resolveTimes: Optional[Dict[str, float]] = None) -> Tuple[List[Clone], Dict[int, Set[int]]]:
+	# Orders the repos for --run --topo. Returns their clones deduplicated, along with which of them each one depends on (as indices into the returned list).
+	# Only dependencies that are in the list themselves are considered. The repos are looked up (and cloned, if necessary) in parallel.
+	# resolveTimes: if set, how long each clone took to look up (or clone) is stored in it, keyed by full repospec
+	depsCache = DepsFile.loadCache()
+
+	def resolve(repo: RepoSpec) -> Tuple[Clone, List[Clone]]:
+		start = time.time()
+		clone: Clone = where(repo, 'py', 'clone')
+		if resolveTimes is not None:
+			resolveTimes[str(clone.repospec)] = time.time() - start
+		deps = [where(dep, 'py', 'skip') for dep in DepsFile.read(Path(clone.path), depsCache) or []]
+		return clone, [dep for dep in deps if dep is not None]
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = jobs or int(config.clone_jobs)) as executor:
+		resolved = list(executor.map(resolve, repos))
+	keys = {str(clone.repospec) for clone, _ in resolved}
+	graph = DepGraph()
+	for clone, deps in resolved:
+		graph.addNode(clone, [str(dep.repospec) for dep in deps if str(dep.repospec) in keys])
+	cycles, _ = graph.analyze()
+	if cycles:
+		raise ValueError(f"Dependency cycle: {' -> '.join(cycles[0] + cycles[0][:1])}")
+	index = {key: i for i, key in enumerate(graph.nodes)}
+	return list(graph.nodes.values()), {index[key]: {index[dep] for dep in edges} for key, edges in graph.edges.items()}
+
+def runPool(repos: List[Union[RepoSpec, Clone]], cmd: Union[str, List[str]], shell: bool, ignore_errors: bool, jobs: int, stream: bool, deps: Dict[int, Set[int]] = {}, cacheEnv: Optional[List[str]] = None, report: Optional[Report] = None, resolveTimes: Optional[Dict[str, float]] = None) -> int:
+	# Runs the command on up to 'jobs' repos at once, and returns the number of invocations that failed. Unless 'ignore_errors' is set, no new invocations are started after one fails.
+	# Repos that have already been resolved can be passed as clones, in which case their lookup times come from 'resolveTimes' (as filled in by runDependencies())
+	# Each invocation's output is printed all together when it finishes, or line by line with its repospec as a prefix if 'stream' is set.
+	# 'deps' maps a repo's index in 'repos' to the indices of the repos it depends on. A repo isn't started until all of those have succeeded, and is skipped if any of them fail.
+	# If 'cacheEnv' is set, results are cached (see RunCache), keyed on those environment variables among other things. If 'report' is set, every repo's result is added to it
+	printLock = threading.Lock()
+	counts = collections.Counter()
+	live = sys.stderr.isatty()
+	stopping = threading.Event()
+
+	def repospecOf(repo: Union[RepoSpec, Clone]) -> RepoSpec:
+		return repo.repospec if isinstance(repo, Clone) else repo
+
+	def showCounts():
+		if live:
+			print(f"\r\x1b[K{counts['running']} running, {counts['finished']} finished, {counts['failed']} failed", end = '', file = sys.stderr, flush = True)
+
+	def output(text: str):
+		# The live counts are redrawn below the new output
+		with printLock:
+			if live:
+				print('\r\x1b[K', end = '', file = sys.stderr, flush = True)
+			print(text, flush = True)
+			showCounts()
+
+	def job(repo: Union[RepoSpec, Clone]) -> RepoResult:
+		if stopping.is_set():
+			return RepoResult(repospecOf(repo), skipped = True)
+		result = RepoResult(repospecOf(repo), start = time.time())
+		with printLock:
+			counts['running'] += 1
+			showCounts()
+		try:
+			if isinstance(repo, Clone):
+				clone = repo
+				result.resolve_time = resolveTimes.get(str(clone.repospec)) if resolveTimes is not None else None
 			else:
-				shell = (len(cmd) == 1)
-
-			proc = subprocess.Popen(cmd, cwd = str(clone.path), shell = shell, env = env)
-			procs.append(proc)
-			if not bg:
-				proc.wait()
-				if not ignore_errors and proc.returncode != 0:
-					raise RuntimeError(f"Failed on {repo}: exit code {proc.returncode}")
-				print()
-	# Wait for every process to exit. Then exit with the number of processes that failed
-	exit(sum(proc.wait() != 0 for proc in procs))
+				clone = where(repo, 'py', 'clone')
+				result.resolve_time = time.time() - result.start
+			repo = clone.repospec
+			result.repospec, result.path = str(clone.repospec), str(clone.path)
+			key = RunCache.key(clone, cmd, cacheEnv) if cacheEnv is not None else None
+			entry = RunCache.load(key) if key is not None else None
+			if entry is not None and entry['output'] is None:
+				# Recorded by a run that didn't capture the output, so there's nothing to replay. Running again records it
+				entry = None
+			# Cached results don't run anything, so there's nothing to measure
+			sizeBefore = report.sizeBefore(clone.path) if report is not None and entry is None else None
+			if entry is not None:
+				lines = entry['output'].splitlines(keepends = True)
+				if stream:
+					for line in lines:
+						output(f"{repo}: {line.rstrip()}")
+				else:
+					output(f"{repo} (cached)\n{''.join(lines)}")
+				returncode = entry['exit_code']
+			else:
+				proc = subprocess.Popen(cmd, cwd = str(clone.path), shell = shell, env = runEnvironment(clone), stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True, errors = 'replace')
+				lines = []
+				for line in proc.stdout:
+					lines.append(line)
+					if stream:
+						output(f"{repo}: {line.rstrip()}")
+				returncode = proc.wait()
+				if not stream:
+					output(f"{repo}\n{''.join(lines)}")
+				if key is not None and returncode == 0:
+					RunCache.save(key, ''.join(lines))
+			result.exit_code, result.cached = returncode, entry is not None
+			if sizeBefore is not None:
+				sizeAfter = Report.objectStoreSize(clone.path)
+				result.bytes_fetched = sizeAfter - sizeBefore if sizeAfter is not None else None
+		except Exception as e:
+			output(f"{repo}: {e}")
+			result.error = str(e)
+		result.end = time.time()
+		with printLock:
+			counts['running'] -= 1
+			counts['failed' if result.failed else 'finished'] += 1
+			showCounts()
+		if result.failed and not ignore_errors:
+			stopping.set()
+		return result
+
+	results = [RepoResult(repospecOf(repo), skipped = True) for repo in repos]
+	waiting = {i: set(deps.get(i, ())) for i in range(len(repos))}
+	dependents = collections.defaultdict(set)
+	for i, repoDeps in deps.items():
+		for dep in repoDeps:
+			dependents[dep].add(i)
+
+	def skipDependents(i: int):
+		for dependent in dependents[i]:
+			if waiting.pop(dependent, None) is not None:
+				skipDependents(dependent)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+		running: Dict[concurrent.futures.Future, int] = {}
+		while True:
+			# Start everything whose dependencies have all finished. Repos are started in the order given when there's a choice
+			for i in [i for i, remaining in waiting.items() if not remaining]:
+				del waiting[i]
+				running[executor.submit(job, repos[i])] = i
+			if not running:
+				break
+			done, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				i = running.pop(future)
+				results[i] = future.result()
+				if results[i].exit_code == 0:
+					for dependent in dependents[i]:
+						if dependent in waiting:
+							waiting[dependent].discard(i)
+				else:
+					skipDependents(i)
+	if live:
+		print('\r\x1b[K', end = '', file = sys.stderr)
+
+	# Summarize every invocation, in the order they were requested
+	rows = [('Repository', 'Exit', 'Time')]
+	for result in results:
+		rows.append((result.repospec, '-' if result.skipped else 'error' if result.exit_code is None else str(result.exit_code), 'skipped' if result.skipped else 'cached' if result.cached else f"{result.duration:.1f}s"))
+	widths = [max(len(row[i]) for row in rows) for i in range(2)]
+	print(file = sys.stderr)
+	for row in rows:
+		print(f"{row[0].ljust(widths[0])}  {row[1].ljust(widths[1])}  {row[2]}", file = sys.stderr)
+	if report is not None:
+		report.results.extend(results)
+	return sum(result.failed for result in results)
+
+def run(repos: Iterable[Iterable[RepoSpec]], cmd: List[str], bg: bool, ignore_errors: bool, jobs: Optional[int], stream: bool, topo: bool, cache: bool, cache_env: List[str], report: Optional[str]):
+	if platform.system() == 'Windows':
+		# Passing a whole command as a single string inside a list won't work on Windows, e.g. -x 'foo bar baz'. Turn it into a raw string instead
+		shell = True
+		if len(cmd) == 1:
+			cmd = cmd[0]
+	else:
+		shell = (len(cmd) == 1)
+
+	if jobs is not None and jobs < 1:
+		raise ValueError("--jobs must be at least 1")
+	# Caching is off unless asked for. --cache-env implies --cache
+	cacheEnv = cache_env if cache or cache_env else None
+	if bg and (jobs is not None or topo):
+		raise ValueError(f"--bg and {'--topo' if topo else '--jobs'} can't be used together")
+	if stream and jobs is None and not topo:
+		raise ValueError("--stream requires --jobs or --topo")
+
+	with reporting(report, 'run') as reportData:
+		if topo:
+			resolveTimes = {}
+			order, deps = runDependencies([repo for set in repos for repo in set], jobs, resolveTimes)
+			exit(evictRunCache(cacheEnv, runPool(order, cmd, shell, ignore_errors, jobs or os.cpu_count() or 1, stream, deps, cacheEnv, reportData, resolveTimes)))
+		if jobs is not None:
+			exit(evictRunCache(cacheEnv, runPool([repo for set in repos for repo in set], cmd, shell, ignore_errors, jobs, stream, cacheEnv = cacheEnv, report = reportData)))
+
+		procs = []
+		monitor = LoadMonitor(float(config.run_max_cpu), int(float(config.run_job_memory) * 1024 * 1024), int(config.run_max_jobs)) if bg else None
+
+		def finish(proc: subprocess.Popen, key: Optional[str], result: RepoResult, sizeBefore: Optional[int]):
+			result.end = time.time()
+			result.exit_code = proc.returncode
+			if sizeBefore is not None:
+				sizeAfter = Report.objectStoreSize(Path(result.path))
+				result.bytes_fetched = sizeAfter - sizeBefore if sizeAfter is not None else None
+			if key is not None and proc.returncode == 0:
+				# The output went straight to the terminal, so there's none to replay
+				RunCache.save(key, None)
+
+		for set in repos:
+			for repo in set:
+				result = RepoResult(repo, start = time.time())
+				if reportData is not None:
+					reportData.results.append(result)
+				try:
+					clone: Clone = where(repo, 'py', 'clone')
+				except Exception as e:
+					result.end, result.error = time.time(), str(e)
+					raise
+				result.repospec, result.path, result.resolve_time = str(clone.repospec), str(clone.path), time.time() - result.start
+				key = RunCache.key(clone, cmd, cacheEnv) if cacheEnv is not None else None
+				entry = RunCache.load(key) if key is not None else None
+				if entry is not None:
+					print(f"{clone.repospec} (cached)", file = sys.stderr)
+					if entry['output']:
+						print(entry['output'], end = '')
+					result.end, result.exit_code, result.cached = time.time(), entry['exit_code'], True
+					continue
+				if monitor is not None:
+					monitor.waitForRoom(lambda: sum(proc.poll() is None for proc, *_ in procs))
+				print(str(clone.repospec), file = sys.stderr)
+				sizeBefore = reportData.sizeBefore(clone.path) if reportData is not None else None
+				proc = subprocess.Popen(cmd, cwd = str(clone.path), shell = shell, env = runEnvironment(clone))
+				procs.append((proc, key, result, sizeBefore))
+				if not bg:
+					proc.wait()
+					finish(*procs[-1])
+					if not ignore_errors and proc.returncode != 0:
+						raise RuntimeError(f"Failed on {repo}: exit code {proc.returncode}")
+					print()
+		# Wait for every process to exit, noting when each one does. Then exit with the number of processes that failed
+		pending = [item for item in procs if item[2].end is None]
+		while pending:
+			for item in pending:
+				if item[0].poll() is not None:
+					finish(*item)
+			pending = [item for item in pending if item[2].end is None]
+			if pending:
+				time.sleep(.1)
+		exit(evictRunCache(cacheEnv, sum(proc.returncode != 0 for proc, *_ in procs)))
+
+@contextlib.contextmanager
+def reporting(path: Optional[str], command: str) -> Iterator[Optional[Report]]:
+	# Collects per-repo results for --report, and writes them to 'path' when the command finishes, even if it fails
+	if path is None:
+		yield None
+		return
+	# The registered clones are noted up front, so repos cloned while resolving count everything they fetched
+	report = Report(command, (str(clone.path) for clone in Clone.loadAll()))
+	try:
+		yield report
+	finally:
+		report.save(Path(path))
+
+def evictRunCache(cacheEnv: Optional[List[str]], rtn: T) -> T:
+	# Trims the run cache after a --run that used it, and passes 'rtn' through
+	if cacheEnv is not None:
+		RunCache.evict(float(config.run_cache_max_age) * 24 * 60 * 60, int(float(config.run_cache_max_size) * 1024 * 1024))
+	return rtn
 
 def showVersion() -> None:
 	r = git.Repo(str(Path(__file__).resolve().parent.parent))
@@ -885,7 +1772,9 @@ group.add_argument('--on-uncloned', choices = ['clone', 'skip', 'fail', 'fake'],
 group.add_argument('--no-clone', action = 'store_const', dest = 'on_uncloned', const = 'skip', help = argparse.SUPPRESS) # backwards-compatibility version of --on-uncloned=skip
 whereParser.add_argument('-d', '--dest', nargs = '?', default = None, help = 'where to store a new clone if one is made')
 whereParser.add_argument('--ignore-missing', action = 'store_true', help = 'return a recorded path even if it no longer exists')
-whereParser.add_argument('--listen', action = 'store_true', help = 'read repospecs interactively from stdin')
+whereParser.add_argument('--listen', action = 'store_true', help = "read repospecs interactively from stdin. Lines of the form 'id<TAB>spec' are handled concurrently and answered as 'id<TAB>ok<TAB>paths' or 'id<TAB>error<TAB>message'")
+whereParser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of repositories (or --listen requests) to look up or clone at once (defaults to the clone_jobs config key)')
+whereParser.add_argument('--report', metavar = 'FILE', default = None, help = "write each repository's lookup time and result to FILE, as JUnit XML if it ends in .xml and JSON otherwise")
 
 hereParser = makeMode('here', here, 'set the local path of a package')
 hereParser.add_argument('repo', type = type_repospec)
@@ -905,6 +1794,12 @@ clonesParser.add_argument('--format', choices = ['plain', 'json'], default = 'pl
 hostsParser = makeMode('hosts', showHosts, 'list all registered git hosts')
 hostsParser.add_argument('--format', choices = ['plain', 'json'], default = 'plain')
 
+statusParser = makeMode('status', showStatus, 'show the branch and state of registered clones')
+statusParser.add_argument('repos', nargs = '*', type = type_repospec, help = 'clones to show (default all)')
+statusParser.add_argument('--format', choices = ['plain', 'json'], default = 'plain')
+statusParser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of clones to check at once (defaults to the clone_jobs config key)')
+statusParser.add_argument('--no-cache', action = 'store_true', help = 'check every clone instead of reusing cached statuses')
+
 addHostParser = makeMode('add-host', addHost, 'add a new git host')
 addHostParser.add_argument('name', type = type_host_name)
 addHostParser.add_argument('url')
@@ -935,10 +1830,24 @@ depsParser.add_argument('repo', nargs = '?', type = type_repospec, default = Non
 depsParser.add_argument('--format', default = '%p', help = 'Format to display each line in')
 depsParser.add_argument('-f', '--file', default = None, help = 'File to read dependency information from')
 depsParser.add_argument('--on-uncloned', choices = ['clone', 'skip', 'fail'], default = 'clone', help = "what to do if a dependency doesn't exist")
+depsParser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of dependencies to look up or clone at once (defaults to the clone_jobs config key)')
+depsParser.add_argument('--no-cache', action = 'store_true', help = 'reread every dependencies file instead of using the cached copies')
+depsParser.add_argument('--at', metavar = 'REV', default = None, help = "read the dependencies file as of this revision instead of from the working tree")
+depsParser.add_argument('--plan', action = 'store_true', help = "list every dependency and whether it needs to be cloned, reading the dependency files of uncloned repos from their hosts instead of cloning them")
+depsParser.add_argument('--apply', action = 'store_true', help = 'with --plan, clone everything the plan found missing')
+depsParser.add_argument('--lock', action = 'store_true', help = "write the resolved dependencies (with their clone URLs and commits) to the repo's deps.lock")
+depsParser.add_argument('--no-lock', action = 'store_true', help = 'ignore deps.lock and resolve the dependencies from the deps.got files')
+depsParser.add_argument('--format-graph', choices = ['json', 'dot'], default = None, help = 'output the whole dependency graph, with cycles and topological levels, instead of one line per repo')
+depsParser.add_argument('--snapshot', metavar = 'FILE', default = None, help = "record every dependency's current HEAD in FILE, for a later --changed-since")
+depsParser.add_argument('--watch', action = 'store_true', help = 'output the dependencies as JSON events, and keep watching for changes to them until interrupted')
+depsParser.add_argument('--changed-since', metavar = 'FILE', default = None, help = 'only list dependencies whose HEAD has moved since the --snapshot in FILE was taken, or that have uncommitted changes')
 
 gitParser = makeMode('git', gitPassthrough, 'run a git command on the repo and all its dependencies')
 gitParser.add_argument('-C', '--directory', metavar = 'DIR', default = '.', help = 'root directory')
 gitParser.add_argument('-i', '--ignore-errors', action = 'store_true', help = "don't stop if the git command fails")
+gitParser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of repos to run the command on at once (default 1)')
+gitParser.add_argument('--report', metavar = 'FILE', default = None, help = "write each repository's timings and result to FILE, as JUnit XML if it ends in .xml and JSON otherwise")
+gitParser.add_argument('--stream', action = 'store_true', help = "print each line of output as soon as it's available, prefixed with its repospec, instead of each repo's output together in order")
 gitParser.add_argument('args', nargs = argparse.REMAINDER, help = 'arguments to pass to git')
 
 configParser = makeMode('config', configCLI, 'get/set configuration key(s)')
@@ -963,6 +1872,12 @@ runParser = makeMode('run', run, 'run an arbitrary command on the specified repo
 runParser.add_argument('repos', nargs = '+', type = type_multipart_repospec)
 runParser.add_argument('--bg', action = 'store_true', help = 'run command in the background on each repository in parallel')
 runParser.add_argument('-i', '--ignore-errors', action = 'store_true', help = "don't stop if a command fails")
+runParser.add_argument('-j', '--jobs', type = int, default = None, help = "run the command on up to this many repositories at once, showing each one's output when it finishes")
+runParser.add_argument('--topo', action = 'store_true', help = "run each repository's command once the repositories it depends on have succeeded, as many at once as --jobs allows (default: the number of CPUs)")
+runParser.add_argument('--cache', action = 'store_true', help = "skip repositories whose HEAD and command haven't changed since the command last succeeded there, replaying the recorded result")
+runParser.add_argument('--cache-env', metavar = 'VAR', action = 'append', default = [], help = 'also key the cache on this environment variable (can be repeated; implies --cache)')
+runParser.add_argument('--report', metavar = 'FILE', default = None, help = "write each repository's timings and result to FILE, as JUnit XML if it ends in .xml and JSON otherwise")
+runParser.add_argument('--stream', action = 'store_true', help = "with --jobs, print each line of output as soon as it's available, prefixed with its repospec")
 runParser.add_argument('-x', '--cmd', required = True, nargs = argparse.REMAINDER, help = 'command to run')
 
 versionParser = makeMode('version', showVersion, 'show version information')
@@ -995,6 +1910,9 @@ parser.set_defaults(modeParser = whereParser)
 # First parse to isolate the mode; we get back a namespace containing 'modeParser' for the mode-specific parser, and a list of all the unprocessed arguments to pass on
 args, extraArgs = parser.parse_known_args()
 
+from . import GitProgress
+GitProgress.configure(args.progress_format, args.progress_fd)
+
 # Then use the mode-specific parser to do the real parse
 modeArgs = args.modeParser.parse_args(extraArgs)
 
@@ -1,7 +1,9 @@
 import os
 from pathlib import Path
 import platform
+import re
 import string
+import subprocess
 import sys
 import types
 from typing import *
@@ -12,6 +14,10 @@ gotRoot = Path(gotRoot).resolve() if gotRoot is not None else (Path.home() / '.g
 class Template(string.Template):
 	delimiter = '%'
 
+	def fields(self) -> Set[str]:
+		# The names of all the fields the template refers to
+		return {match.group('named') or match.group('braced') for match in self.pattern.finditer(self.template) if match.group('named') or match.group('braced')}
+
 # Functions decorated with this will have their stdout redirected to stderr, and their return value printed to outputFile (stdout if none supplied)
 def print_return(f, onNone = None):
 	def wrap(*, outputFile = sys.stdout, **kw):
@@ -50,10 +56,150 @@ def makeGitEnvironment(host: 'Host') -> Dict[str, str]:
 		'GOT_HOSTNAME': host.name,
 		'GOT_ROOT': str(gotRoot),
 	}
+	rtn.update(makeSshEnvironment(host))
+	return rtn
+
+# Unix socket paths are limited to around 104 bytes; ssh names the sockets with a 40 character hash
+MAX_CONTROL_DIR_LENGTH = 60
+
+def sshControlDir(hostName: str) -> Path:
+	return gotRoot / 'ssh' / hostName
+
+def makeSshEnvironment(host: 'Host') -> Dict[str, str]:
+	# Git runs ssh for every fetch and clone over SSH. Unless ssh_control_persist is 0, each got host gets a shared master connection (an SSH ControlMaster) that every git process reuses instead of
+	# doing its own handshake. The master stays open for ssh_control_persist seconds after it was last used, so consecutive got commands can share it too
+	from .Config import config
+	ssh = 'ssh'
+	persist = int(config.ssh_control_persist)
+	controlDir = sshControlDir(host.name)
+	if persist > 0 and platform.system() != 'Windows' and len(str(controlDir)) <= MAX_CONTROL_DIR_LENGTH:
+		controlDir.mkdir(mode = 0o700, parents = True, exist_ok = True)
+		ssh = f'ssh -o ControlMaster=auto -o ControlPath="{controlDir}/%C" -o ControlPersist={persist}'
+
 	if host.ssh_key_path is not None:
-		rtn['GIT_SSH_COMMAND'] = f'ssh -i "{host.ssh_key_path}"'
+		return {'GIT_SSH_COMMAND': f'{ssh} -i "{host.ssh_key_path}"'}
+	if ssh != 'ssh' and 'GIT_SSH_COMMAND' not in os.environ and 'GIT_SSH' not in os.environ:
+		# Don't override the user's own ssh command
+		return {'GIT_SSH_COMMAND': ssh}
+	return {}
+
+def closeSshConnections(hostName: str):
+	# Shuts down any shared SSH connections for the host, e.g. because its settings have changed
+	controlDir = sshControlDir(hostName)
+	if not controlDir.is_dir():
+		return
+	for socket in controlDir.iterdir():
+		# The destination is required but ignored, since the control path is given directly
+		subprocess.run(['ssh', '-o', f"ControlPath={socket}", '-O', 'exit', hostName], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		try:
+			socket.unlink()
+		except FileNotFoundError:
+			pass
+
+def gitFsmonitorSettings() -> Dict[str, str]:
+	# git settings that make repeated 'git status' calls cheap when the git_fsmonitor option is on: the untracked cache, and the builtin filesystem monitor daemon where git has one (macOS and Windows)
+	from .Config import config
+	if config.git_fsmonitor != 'true':
+		return {}
+	rtn = {'core.untrackedCache': 'true'}
+	if platform.system() in ('Darwin', 'Windows'):
+		rtn['core.fsmonitor'] = 'true'
 	return rtn
 
+def porcelainStatus(repoPath: Path, untracked: bool = False) -> Tuple[Dict[str, str], bool]:
+	# Runs 'git status' once for both the branch information ('oid', 'head', 'upstream', 'ab' from the '# branch.*' headers) and whether any tracked files have changed.
+	# Untracked files only count if 'untracked' is set, since looking for them is the slowest part of 'git status' on a big tree
+	settings = [arg for key, value in gitFsmonitorSettings().items() for arg in ('-c', f"{key}={value}")]
+	proc = subprocess.run(['git', *settings, '-C', str(repoPath), 'status', '--porcelain=v2', '--branch', f"--untracked-files={'normal' if untracked else 'no'}"], stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+	if proc.returncode != 0:
+		raise RuntimeError(f"Unable to get status of {repoPath}: {proc.stderr.strip()}")
+	branch, changed = {}, False
+	for line in proc.stdout.splitlines():
+		if line.startswith('# branch.'):
+			key, _, value = line[len('# branch.'):].partition(' ')
+			branch[key] = value
+		elif not line.startswith('#'):
+			changed = True
+	return branch, changed
+
+def trackedChanges(repoPath: Path) -> bool:
+	# Whether any tracked file differs from HEAD, staged or not. Much cheaper than porcelainStatus() since it skips the branch and upstream comparison.
+	# --no-optional-locks keeps git from rewriting the index as it refreshes it, which would invalidate anything stamped with the index's modification time
+	settings = [arg for key, value in gitFsmonitorSettings().items() for arg in ('-c', f"{key}={value}")]
+	proc = subprocess.run(['git', '--no-optional-locks', *settings, '-C', str(repoPath), 'diff', '--quiet', 'HEAD', '--'], stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+	if proc.returncode not in (0, 1):
+		raise RuntimeError(f"Unable to get status of {repoPath}: {proc.stderr.strip()}")
+	return proc.returncode == 1
+
+def formatSize(size: int) -> str:
+	for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+		if size < 1024:
+			return f"{size} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+		size /= 1024
+	return f"{size:.1f} TiB"
+
+def formatAge(seconds: float) -> str:
+	for unit, length in (('day', 86400), ('hour', 3600), ('minute', 60)):
+		if seconds >= length:
+			n = int(seconds // length)
+			return f"{n} {unit}{'' if n == 1 else 's'} ago"
+	return 'just now'
+
+SHA_PATTERN = re.compile('^[0-9a-f]{40}$')
+
+def gitDirs(repoPath: Path) -> Optional[Tuple[Path, Path]]:
+	# Returns a repository's git directory, and the directory it shares refs and objects from (the same one, except in worktrees). Returns None if they can't be found
+	try:
+		gitDir = repoPath / '.git'
+		if gitDir.is_file():
+			# Worktrees and submodules have a .git file pointing to the real directory
+			content = gitDir.read_text().strip()
+			if not content.startswith('gitdir: '):
+				return None
+			gitDir = (repoPath / content[len('gitdir: '):]).resolve()
+		if not gitDir.is_dir():
+			return None
+		commonDir = (gitDir / (gitDir / 'commondir').read_text().strip()).resolve() if (gitDir / 'commondir').is_file() else gitDir
+		return gitDir, commonDir
+	except (OSError, UnicodeDecodeError):
+		return None
+
+def readHead(repoPath: Path) -> Optional[str]:
+	# Reads the commit a repository's HEAD points to straight out of .git, which is much cheaper than opening the repo with GitPython or running git.
+	# Returns None if HEAD is unborn or the repository is laid out in a way this doesn't understand, in which case the caller should ask git instead
+	dirs = gitDirs(repoPath)
+	if dirs is None:
+		return None
+	# Worktrees keep their own HEAD, but share their refs with the main repository
+	gitDir, commonDir = dirs
+	try:
+		head = (gitDir / 'HEAD').read_text().strip()
+		for _ in range(5): # Symbolic refs can point to other symbolic refs, but not forever
+			if not head.startswith('ref: '):
+				return head if SHA_PATTERN.match(head) else None
+			ref = head[len('ref: '):]
+			try:
+				head = (commonDir / ref).read_text().strip()
+				continue
+			except (FileNotFoundError, IsADirectoryError):
+				pass
+			try:
+				with open(commonDir / 'packed-refs') as f:
+					head = next((line.split(' ', 1)[0] for line in f if line.rstrip('\n').endswith(f" {ref}") and not line.startswith(('#', '^'))), None)
+			except FileNotFoundError:
+				head = None
+			if head is None:
+				return None
+		return None
+	except (OSError, UnicodeDecodeError):
+		return None
+
+# contextlib.nullcontext is only available in Python 3.7+
+class nullcontext:
+	def __enter__(self):
+		pass
+	def __exit__(self, *excinfo):
+		pass
 
 class VerboseBlock:
 	def __init__(self, set):
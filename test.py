@@ -3,6 +3,7 @@ import colorama
 import contextlib
 import fnmatch
 import git
+import hashlib
 import inspect
 from json import loads as fromJS, dumps as toJS
 import keyring
@@ -11,6 +12,8 @@ from pathlib import Path
 import platform
 import re
 import shutil
+import signal
+import sqlite3
 import string
 import subprocess
 import sys
@@ -33,6 +36,7 @@ parser.add_argument('--host-data')
 parser.add_argument('--junit', action = 'store_true')
 parser.add_argument('--verbose', '-v', action = 'store_true')
 parser.add_argument('--list', action = 'store_true', help = 'list test cases instead of running them')
+parser.add_argument('--benchmarks', action = 'store_true', help = 'also run benchmarks, which report timings instead of checking behavior')
 parser.add_argument('tests', nargs = '*')
 args, extraArgs = parser.parse_known_args()
 
@@ -590,6 +594,58 @@ class Tests(TestCase):
 			test('repo1+', ['repo1', 'repo2', 'repo3', 'repo4'])
 			test('repo2+', ['repo2', 'repo4'])
 
+	def test_where_listen_requests(self):
+		if not hasattr(os, 'mkfifo'):
+			self.skipTest("Needs named pipes")
+		self.deps_helper()
+		# Reading '@fifo' blocks until something is written to the pipe, which stands in for a slow clone
+		os.mkfifo('fifo')
+
+		r = GotRun(['--listen', '--jobs', '2'])
+		args = r.makeCommand()
+		env = r.makeEnvironment()
+		del r
+
+		with subprocess.Popen(args, env = env, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL) as proc:
+			def send(line):
+				proc.stdin.write(f"{line}\n".encode('utf-8'))
+				proc.stdin.flush()
+
+			def receive():
+				return proc.stdout.readline().decode('utf-8').rstrip('\n').split('\t')
+
+			# The blocked request doesn't hold up the ones after it
+			send('slow\t@fifo')
+			send('fast\trepo2')
+			self.assertEqual(receive(), ['fast', 'ok', str(Path('repo2').resolve())])
+			send('deps\trepo2+')
+			self.assertEqual(receive(), ['deps', 'ok', str(Path('repo2').resolve()), str(Path('repo4').resolve())])
+
+			# Errors are reported per request, and don't end the session
+			send('bad\tf[]#!')
+			response = receive()
+			self.assertEqual(response[:2], ['bad', 'error'])
+			self.assertIn('Invalid repospec', response[2])
+
+			# Plain lines still get plain answers
+			send('repo1')
+			self.assertEqual(receive(), [str(Path('repo1').resolve())])
+
+			Path('fifo').write_text('repo3\n')
+			self.assertEqual(receive(), ['slow', 'ok', str(Path('repo3').resolve())])
+
+			proc.stdin.close()
+			self.assertEqual(proc.stdout.read(), b'')
+			self.assertEqual(proc.wait(), 0)
+
+		# A plain line that fails is reported without waiting for the requests still running
+		with subprocess.Popen(args, env = env, stdin = subprocess.PIPE, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE) as proc:
+			proc.stdin.write(b"slow\t@fifo\nf[]#!\n")
+			proc.stdin.flush()
+			self.assertIn(b'Invalid repospec', proc.stderr.readline())
+			Path('fifo').write_text('repo3\n')
+			self.assertNotEqual(proc.wait(), 0)
+
 	def test_where_default_branch(self):
 		# Make a "host" folder with a bunch of repos on different branches
 		hostDir = Path('host')
@@ -655,6 +711,131 @@ class Tests(TestCase):
 							pass
 					self.assertEqual(repo.active_branch.name, expected_branch)
 
+	def test_where_clone_fatal_error(self):
+		# With a clone URL pattern the host never checks if the repo exists, so the failure happens during the clone itself
+		Path('host').mkdir()
+		self.addHost('daemon', 'host', 'http://localhost', cloneUrl = os.path.realpath('host') + '/%rs', force = True)
+		with GotRun(['--config', 'clone_retries', '3']):
+			pass
+		with GotRun(['--config', 'clone_retry_delay', '30']):
+			pass
+		with GotRun(['repo']) as r:
+			# A missing repository should fail immediately instead of retrying
+			start = timeit.default_timer()
+			r.assertFails()
+			end = timeit.default_timer()
+			self.assertTrue(end - start < 25)
+			r.assertInStderr('Clone failed')
+		self.assertFalse(Path('repos/host/repo').exists())
+
+	def test_where_interrupted_clone(self):
+		r = git.Repo.init(str(Path('host') / 'repo'))
+		Path('host/repo/file').write_text('contents')
+		r.index.add(['file'])
+		r.index.commit('Initial commit')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+
+		# Simulate a clone that was killed after fetching had started
+		staging = Path('repos/host/.repo.got-clone')
+		staging.mkdir(parents = True)
+		git.Repo.init(str(staging)).create_remote('origin', 'bad-url')
+
+		with GotRun(['repo']) as r:
+			r.assertInStderr('from an interrupted clone')
+			clonePath = Path(r.stdout.strip())
+		self.assertEqual(clonePath, Path('repos/host/repo').resolve())
+		self.assertEqual((clonePath / 'file').read_text(), 'contents')
+		self.assertFalse(staging.exists())
+
+		# A clone that was killed after fetching the branch tips carries on with the rest of the history
+		r = git.Repo.init(str(Path('host') / 'deep'))
+		for _ in range(100):
+			r.index.commit('Commit')
+		staging = Path('repos/host/.deep.got-clone')
+		partial = git.Repo.init(str(staging))
+		partial.create_remote('origin', os.path.realpath('host/deep'))
+		partial.git.fetch('--depth', '1', 'origin')
+		self.assertTrue((staging / '.git' / 'shallow').exists())
+		with GotRun(['deep']) as r:
+			r.assertInStderr('from an interrupted clone')
+			clonePath = Path(r.stdout.strip())
+		clone = git.Repo(str(clonePath))
+		self.assertEqual(len(list(clone.iter_commits())), 100)
+		self.assertFalse((clonePath / '.git' / 'shallow').exists())
+
+	def test_where_many_parallel(self):
+		for i in range(6):
+			git.Repo.init(str(Path('host') / f"repo{i}")).index.commit('Initial commit')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+		# repo3 is requested twice, so one of the lookups waits on the other's clone
+		specs = [f"repo{i}" for i in (3, 0, 5, 3, 1, 4, 2)]
+		with GotRun(specs + ['--jobs', '3']) as r:
+			# Results come back in the order they were requested regardless of which clone finishes first
+			self.assertEqual(r.stdout.strip().split(os.linesep), [str(Path('repos/host', spec).resolve()) for spec in specs])
+		for spec in specs:
+			self.assertTrue(Path('repos/host', spec, '.git').is_dir())
+
+	def test_where_progress_json(self):
+		git.Repo.init(str(Path('host') / 'repo')).index.commit('Initial commit')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+		with GotRun(['repo', '--progress-format', 'json']) as r:
+			events = [fromJS(line) for line in r.stderr.split(os.linesep) if line.startswith('{')]
+			self.assertEqual(r.stdout.strip(), str(Path('repos/host/repo').resolve()))
+		self.assertTrue(events)
+		for event in events:
+			self.assertEqual(event['repospec'], 'host:repo')
+			self.assertEqual(set(event), {'repospec', 'phase', 'count', 'total', 'bytes', 'rate', 'timestamp'})
+		self.assertEqual(events[0]['phase'], 'starting')
+		self.assertEqual(events[-1]['phase'], 'done')
+
+	def test_where_inflight_clone(self):
+		# Pretend another process is in the middle of cloning each repo, and check that got waits for it and uses its result
+		self.addHost('daemon', 'host', 'http://localhost', 'user', 'pw', force = True)
+		Path('repo1').mkdir()
+		conn = sqlite3.connect('db', isolation_level = None)
+		owners = {}
+
+		def startOwner(name):
+			# A cloning process holds an exclusive lock on the clone's lock file until it's done. Windows has no such lock, so there it's the repo lock
+			if platform.system() == 'Windows':
+				owner = subprocess.Popen('ping 127.0.0.1 -n 30', shell = True, stdout = subprocess.DEVNULL)
+				conn.execute("INSERT INTO locks(key, pid, count) VALUES(?, ?, 1)", (f"repo.{name}", owner.pid))
+			else:
+				lockPath = Path('inflight') / f"{hashlib.sha1(name.encode('utf-8')).hexdigest()}.lock"
+				lockPath.parent.mkdir(exist_ok = True)
+				owner = subprocess.Popen([sys.executable, '-c', "import fcntl, sys, time; f = open(sys.argv[1], 'a'); fcntl.flock(f, fcntl.LOCK_EX); print(flush = True); time.sleep(30)", str(lockPath)], stdout = subprocess.PIPE)
+				owner.stdout.readline()
+			conn.execute("INSERT INTO inflight_clones(key, pid, repospec, path, status, updated) VALUES(?, ?, ?, ?, 'cloning', ?)", (name, owner.pid, f"host:{name}", str(Path(name).resolve()), time.time()))
+			owners[name] = owner
+
+		def finishOwner(name, status, error = None):
+			conn.execute("UPDATE inflight_clones SET status = ?, error = ? WHERE key = ?", (status, error, name))
+			conn.execute("DELETE FROM locks WHERE key = ?", (f"repo.{name}",))
+			owners[name].kill()
+			owners[name].wait()
+
+		try:
+			for name in ('repo1', 'repo2'):
+				startOwner(name)
+
+			with GotRun(['repo1']) as r:
+				time.sleep(2)
+				finishOwner('repo1', 'done')
+				r.assertWorks()
+				r.assertInStderr('waiting for clone in progress')
+				self.assertEqual(r.stdout.strip(), str(Path('repo1').resolve()))
+
+			with GotRun(['repo2']) as r:
+				time.sleep(2)
+				finishOwner('repo2', 'failed', 'Simulated failure')
+				r.assertFails()
+				r.assertInStderr('Simulated failure')
+		finally:
+			conn.close()
+			for owner in owners.values():
+				owner.kill()
+				owner.wait()
+
 	def test_here(self):
 		hostData = self.addBitbucketHost('bitbucket')
 		repospec = hostData['repospecs'][0]
@@ -802,6 +983,16 @@ class Tests(TestCase):
 			with GotRun(['--here', f"host:{name}", str(d), '--force']):
 				pass
 
+	def commit_helper(self, name, deps = None):
+		# Commit to a real repo in the 'host' folder, with the given deps.got contents (or none). Returns the new commit's SHA
+		r = git.Repo.init(str(Path('host') / name))
+		if deps is not None:
+			(Path('host') / name / 'deps.got').write_text(deps)
+			r.index.add(['deps.got'])
+		else:
+			r.index.remove(['deps.got'], working_tree = True, ignore_unmatch = True)
+		return r.index.commit('Commit').hexsha
+
 	def test_deps_cwd(self):
 		self.deps_helper()
 		testRoot = Path.cwd()
@@ -825,6 +1016,151 @@ class Tests(TestCase):
 		with GotRun(['--deps', 'repo2']) as r:
 			self.assertEqual(set(r.stdout.strip().split(os.linesep)), {str(Path(n).resolve()) for n in expectedDeps})
 
+	def test_deps_order(self):
+		self.deps_helper()
+		# Dependencies are resolved in parallel, but still output in breadth-first order
+		for jobs in ('1', '4'):
+			with self.subTest(jobs = jobs):
+				with GotRun(['--deps', 'repo1', '--format', '%rs', '--jobs', jobs]) as r:
+					self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2', 'repo3', 'repo4'])
+
+	def test_deps_cache(self):
+		self.deps_helper()
+		# Backdate the files so they're old enough to be cached
+		depsFile = Path('repo2/deps.got')
+		os.utime(depsFile, (time.time() - 60, time.time() - 60))
+		with GotRun(['--deps', 'repo2', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo2', 'repo4'])
+
+		# Same size and modification time, so the cached copy is used
+		stat = depsFile.stat()
+		depsFile.write_text('repo3')
+		os.utime(depsFile, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+		with GotRun(['--deps', 'repo2', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo2', 'repo4'])
+		with GotRun(['--deps', 'repo2', '--format', '%rs', '--no-cache']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo2', 'repo3'])
+
+		# Changing the file invalidates the cached copy
+		depsFile.write_text('repo1')
+		with GotRun(['--deps', 'repo2', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo2', 'repo1', 'repo3'])
+
+	def test_deps_plan(self):
+		pinned = self.commit_helper('repo3', 'repo4')
+		self.commit_helper('repo3')
+		self.commit_helper('repo4')
+		self.commit_helper('repo2', f"repo3@{pinned}")
+		self.commit_helper('repo1', 'repo2\nrepo3')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+
+		# The dependency files are read from the host without cloning anything
+		with GotRun(['--deps', 'repo1', '--plan']) as r:
+			self.assertEqual([line.split('\t')[:2] for line in r.stdout.strip().split(os.linesep)], [
+				['host:repo1', 'clone'],
+				['host:repo2', 'clone'],
+				['host:repo3', 'clone'],
+				[f"host:repo3@{pinned}", 'clone'],
+				['host:repo4', 'clone'],
+			])
+			r.assertInStderr("5 repositories to clone")
+		self.assertFalse(Path('repos').exists())
+
+		with GotRun(['--deps', 'repo1', '--plan', '--apply']):
+			pass
+		with GotRun(['--deps', 'repo1', '--plan']) as r:
+			self.assertEqual({line.split('\t')[1] for line in r.stdout.strip().split(os.linesep)}, {'cloned'})
+			r.assertInStderr("0 repositories to clone")
+		with GotRun(['--deps', 'repo1', '--format', '%RS', '--on-uncloned', 'fail']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['host:repo1', 'host:repo2', 'host:repo3', f"host:repo3@{pinned}", 'host:repo4'])
+
+	def test_deps_lock(self):
+		self.commit_helper('repo3')
+		repo2Sha = self.commit_helper('repo2', 'repo3')
+		self.commit_helper('repo1', 'repo2')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+
+		with GotRun(['--deps', 'repo1', '--lock']) as r:
+			r.assertInStderr("Locked 2 dependencies")
+		lock = fromJS(Path('repos/host/repo1/deps.lock').read_text())
+		self.assertEqual([(repo['repospec'], repo['host'], repo['url']) for repo in lock['repos']], [
+			('host:repo2', 'host', os.path.realpath('host/repo2')),
+			('host:repo3', 'host', os.path.realpath('host/repo3')),
+		])
+		self.assertEqual(lock['repos'][0]['sha'], repo2Sha)
+
+		# The locked closure is used without reading the dependencies' deps.got files, and missing clones are checked out at the locked commit
+		Path('repos/host/repo2/deps.got').write_text('repo4')
+		shutil.rmtree('repos/host/repo3')
+		with GotRun(['--deps', 'repo1', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2', 'repo3'])
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--no-lock']) as r:
+			r.assertFails()
+
+		# Clones that have moved away from the locked commit are warned about, but left where they are
+		r = git.Repo('repos/host/repo2')
+		moved = r.index.commit('Move').hexsha
+		with GotRun(['--deps', 'repo1', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2', 'repo3'])
+			r.assertInStderr(f"host:repo2: checked out at {moved[:7]}, but locked at {repo2Sha[:7]}")
+		self.assertEqual(git.Repo('repos/host/repo2').head.commit.hexsha, moved)
+
+		# Changing the root deps.got invalidates the lock
+		self.commit_helper('repo4')
+		Path('repos/host/repo1/deps.got').write_text('repo2\nrepo4')
+		with GotRun(['--deps', 'repo1', '--format', '%rs']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2', 'repo4'])
+
+	def test_deps_format_graph(self):
+		self.deps_helper()
+		with GotRun(['--deps', 'repo1', '--format-graph', 'json']) as r:
+			graph = fromJS(r.stdout)
+		self.assertEqual([node['id'] for node in graph['nodes']], ['host:repo1', 'host:repo2', 'host:repo3', 'host:repo4'])
+		self.assertEqual({(edge['from'], edge['to']) for edge in graph['edges']}, {('host:repo1', 'host:repo2'), ('host:repo1', 'host:repo3'), ('host:repo2', 'host:repo4')})
+		self.assertEqual(graph['cycles'], [])
+		self.assertEqual([set(level) for level in graph['levels']], [{'host:repo3', 'host:repo4'}, {'host:repo2'}, {'host:repo1'}])
+
+		# Everything in a cycle shares a level
+		Path('repo4/deps.got').write_text('repo2')
+		with GotRun(['--deps', 'repo1', '--format-graph', 'json']) as r:
+			graph = fromJS(r.stdout)
+		self.assertEqual([set(cycle) for cycle in graph['cycles']], [{'host:repo2', 'host:repo4'}])
+		self.assertEqual([set(level) for level in graph['levels']], [{'host:repo2', 'host:repo3', 'host:repo4'}, {'host:repo1'}])
+
+		with GotRun(['--deps', 'repo1', '--format-graph', 'dot']) as r:
+			self.assertTrue(r.stdout.startswith('digraph deps {'))
+			r.assertInStdout('"host:repo1" -> "host:repo2";')
+			r.assertInStdout('"host:repo2" -> "host:repo4" [color=red];')
+
+	def test_deps_watch(self):
+		if platform.system() == 'Windows':
+			self.skipTest("Needs SIGINT")
+		self.deps_helper()
+		with GotRun(['--deps', 'repo1', '--watch']) as r:
+			def nextEvent():
+				event = fromJS(r.proc.stdout.readline().decode('utf-8'))
+				return event['event'], event['repospec']
+			try:
+				self.assertEqual([nextEvent() for _ in range(4)], [('add', 'host:repo1'), ('add', 'host:repo2'), ('add', 'host:repo3'), ('add', 'host:repo4')])
+
+				Path('repo1/deps.got').write_text('repo3')
+				self.assertEqual({nextEvent(), nextEvent()}, {('remove', 'host:repo2'), ('remove', 'host:repo4')})
+				Path('repo3/deps.got').write_text('repo4')
+				self.assertEqual(nextEvent(), ('add', 'host:repo4'))
+
+				# A clone that's re-registered somewhere else with a bad deps.got is reported without ending the stream
+				Path('repo3b').mkdir()
+				Path('repo3b/deps.got').write_text('f[]#!')
+				with GotRun(['--here', 'host:repo3', 'repo3b', '--force']):
+					pass
+				self.assertEqual(nextEvent(), ('error', 'host:repo3'))
+				Path('repo1/deps.got').write_text('')
+				self.assertEqual({nextEvent(), nextEvent()}, {('remove', 'host:repo3'), ('remove', 'host:repo4')})
+			finally:
+				# Give it a moment to go back to waiting for changes, where it expects to be interrupted
+				time.sleep(.5)
+				r.proc.send_signal(signal.SIGINT)
+
 	def test_deps_bad_repospec(self):
 		with GotRun(['--deps', 'bad_repospec']) as r:
 			r.assertFails()
@@ -849,6 +1185,11 @@ class Tests(TestCase):
 			}
 			self.assertEqual(set(r.stdout.strip().split(os.linesep)), expected)
 
+		# HEADs are read straight from .git, so make sure packed refs are found too
+		r1.git.pack_refs('--all')
+		with GotRun(['--deps', 'repo1', '--format', '%rs %H']) as r:
+			r.assertInStdout(f"repo1 {r1.head.commit.hexsha}")
+
 	def test_deps_bad_format(self):
 		self.deps_helper()
 		with GotRun(['--deps', 'repo1', '--format', '%bad']) as r:
@@ -884,6 +1225,54 @@ class Tests(TestCase):
 
 		return r1, r2, r3
 
+	def test_deps_at(self):
+		r1, r2, r3 = self.git_helper()
+		Path('repo1/deps.got').write_text("repo2\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Commit')
+		# Uncommitted changes aren't seen either
+		Path('repo1/deps.got').write_text("repo3\n")
+
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--at', 'HEAD~1']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2', 'repo3'])
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--at', 'HEAD']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2'])
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--at', 'bad-revision']) as r:
+			r.assertFails()
+			r.assertInStderr("unknown revision bad-revision")
+
+		# A pinned dependency that isn't cloned is read from the unpinned clone
+		Path('repo2/deps.got').write_text("repo3\n")
+		r2.index.add(['deps.got'])
+		pinned = r2.index.commit('Commit').hexsha
+		Path('repo1/deps.got').write_text(f"repo2@{pinned}\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Commit')
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--at', 'HEAD', '--on-uncloned', 'skip']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo3'])
+
+	def test_deps_changed_since(self):
+		r1, r2, r3 = self.git_helper()
+		with GotRun(['--deps', 'repo1', '--snapshot', 'snapshot.json']) as r:
+			r.assertInStderr("Recorded 3 repositories")
+		self.assertEqual(fromJS(Path('snapshot.json').read_text())['heads']['host:repo2'], r2.head.commit.hexsha)
+
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--changed-since', 'snapshot.json']) as r:
+			self.assertEqual(r.stdout.strip(), '')
+
+		# New commits and uncommitted changes both count, but untracked files don't
+		r2.index.commit('Commit')
+		Path('repo3/untracked').write_text('')
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--changed-since', 'snapshot.json']) as r:
+			self.assertEqual(r.stdout.strip(), 'repo2')
+		Path('repo1/deps.got').write_text("repo2\nrepo3\n\n")
+		with GotRun(['--deps', 'repo1', '--format', '%rs', '--changed-since', 'snapshot.json']) as r:
+			self.assertEqual(r.stdout.strip().split(os.linesep), ['repo1', 'repo2'])
+
+		with GotRun(['--deps', 'repo1', '--changed-since', 'missing.json']) as r:
+			r.assertFails()
+			r.assertInStderr("Unable to read snapshot missing.json")
+
 	def test_git_cwd(self):
 		r1, r2, r3 = self.git_helper()
 		with chdir('repo1'):
@@ -909,12 +1298,198 @@ class Tests(TestCase):
 			actual = dict(zip(lines[::2], lines[1::2]))
 			self.assertEqual(expected, actual)
 
+	def test_git_jobs(self):
+		r1, r2, r3 = self.git_helper()
+		with GotRun(['--git', '-C', 'repo1', 'show-ref']) as r:
+			serial = r.stdout
+		# The output comes out in the same order no matter how many repos run at once
+		with GotRun(['--git', '-C', 'repo1', '--jobs', '3', 'show-ref']) as r:
+			self.assertEqual(r.stdout, serial)
+			r.assertInStderr("Ran git show-ref on 3 repositories")
+
+		with GotRun(['--git', '-C', 'repo1', '--jobs', '3', '--stream', 'show-ref']) as r:
+			self.assertEqual(set(r.stdout.strip().split(os.linesep)), {
+				f"host:repo1: {r1.head.commit.hexsha} refs/heads/master",
+				f"host:repo2: {r2.head.commit.hexsha} refs/heads/master",
+				f"host:repo3: {r3.head.commit.hexsha} refs/heads/master",
+			})
+
+		# --jobs isn't limited by clone_jobs
+		for r in (r1, r2, r3):
+			r.git.config('alias.slow', '!sleep 2')
+		with GotRun(['--config', 'clone_jobs', '1']):
+			pass
+		with GotRun(['--git', '-C', 'repo1', '--jobs', '3', 'slow']) as r:
+			start = timeit.default_timer()
+			r.assertWorks()
+			self.assertLess(timeit.default_timer() - start, 5)
+
+		# Once a repo fails, no more are started. repo1 is resolved first, and its dependencies aren't known until the command has run on it
+		with GotRun(['--git', '-C', 'repo1', '--jobs', '1', 'show', '-s', r2.head.commit.hexsha]) as r:
+			r.assertFails()
+			self.assertNotIn(r2.head.commit.hexsha, r.stdout)
+
+	def test_git_changes_deps(self):
+		# A command that changes a repo's deps.got affects which dependencies it's run on
+		r1, r2, r3 = self.git_helper()
+		for r in (r1, r2, r3):
+			r.create_head('other')
+		Path('repo1/deps.got').write_text("repo2\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Commit')
+		with GotRun(['--git', '-C', 'repo1', 'checkout', '-q', 'other']) as r:
+			self.assertEqual([line for line in r.stdout.split(os.linesep) if line], ['host:repo1', 'host:repo2', 'host:repo3'])
+		with GotRun(['--git', '-C', 'repo1', 'checkout', '-q', 'master']) as r:
+			self.assertEqual([line for line in r.stdout.split(os.linesep) if line], ['host:repo1', 'host:repo2'])
+
+	def test_git_pinned_status(self):
+		r1, r2, r3 = self.git_helper()
+		Path('repo1/deps.got').write_text(f"repo2@{r2.head.commit.hexsha}\nrepo3@master\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Commit')
+		for name in ('repo2', 'repo3'):
+			with GotRun(['--here', f"host:{name}@{'master' if name == 'repo3' else r2.head.commit.hexsha}", name, '--force']):
+				pass
+		with GotRun(['--git', '-C', 'repo1', 'status']) as r:
+			self.assertNotIn('version-pinned', r.stdout)
+
+		# Untracked files are fine, but changes to tracked files and moving HEAD aren't
+		Path('repo2/untracked').write_text('foo')
+		Path('repo3/deps.got').write_text('')
+		r3.index.add(['deps.got'])
+		with GotRun(['--git', '-C', 'repo1', 'status']) as r:
+			self.assertNotIn(f"host:repo2@{r2.head.commit.hexsha}: ", r.stdout)
+			r.assertInStdout('host:repo3@master: Unexpected changes in version-pinned repository')
+		r3.index.commit('Commit')
+		r2.index.commit('Commit')
+		with GotRun(['--git', '-C', 'repo1', 'status']) as r:
+			r.assertInStdout(f"host:repo2@{r2.head.commit.parents[0].hexsha}: Wrong HEAD in version-pinned repository")
+			self.assertNotIn('host:repo3@master: ', r.stdout)
+		with GotRun(['--git', '-C', 'repo1', '--jobs', '3', '--stream', 'status']) as r:
+			# The message isn't prefixed with the repospec a second time
+			self.assertIn(f"host:repo2@{r2.head.commit.parents[0].hexsha}: Wrong HEAD in version-pinned repository", r.stdout.split(os.linesep))
+
+		# The fsmonitor setting is passed along to git
+		with GotRun(['--config', 'git_fsmonitor', 'true']):
+			pass
+		with GotRun(['--git', '-C', 'repo1', 'status']) as r:
+			r.assertInStdout('Wrong HEAD in version-pinned repository')
+
+	def test_git_fetch_pinned(self):
+		r1, r2, _ = self.git_helper()
+		upstream = git.Repo.init('upstream')
+		upstream.index.commit('Commit')
+		upstream.create_head('branch')
+		shutil.rmtree('repo2')
+		r2 = git.Repo.clone_from(str(Path('upstream').resolve()), 'repo2')
+		first = upstream.index.commit('Commit')
+		second = upstream.index.commit('Commit')
+		upstream.git.checkout('branch')
+		upstream.index.commit('Commit')
+		with GotRun(['--here', f"host:repo2@{first.hexsha}", 'repo2', '--force']):
+			pass
+		Path('repo1/deps.got').write_text(f"repo2@{first.hexsha}\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Commit')
+
+		# Only the pinned commit is fetched
+		with GotRun(['--git', '-C', 'repo1', 'fetch']):
+			pass
+		self.assertEqual(r2.head.commit, first)
+		self.assertEqual(r2.git.cat_file('-t', first.hexsha), 'commit')
+		self.assertRaises(git.exc.GitCommandError, r2.git.cat_file, '-t', second.hexsha)
+		# Other branches aren't updated
+		self.assertEqual(r2.remotes.origin.refs.branch.commit, first.parents[0])
+
+		# If the pinned commit is already here, the remote isn't contacted at all
+		r2.remotes.origin.set_url('/nonexistent')
+		r2.head.reset('HEAD~1', index = True, working_tree = True)
+		with GotRun(['--git', '-C', 'repo1', '--ignore-errors', 'pull']) as r:
+			# repo1 itself has no remote to pull from
+			self.assertEqual(r.stdout.count('Ignored error'), 1)
+			self.assertNotIn('nonexistent', r.stdout)
+		self.assertEqual(r2.head.commit, first)
+
+	def test_status(self):
+		r1, r2, r3 = self.git_helper()
+		upstream = git.Repo.init('upstream')
+		upstream.index.commit('Commit')
+		shutil.rmtree('repo2')
+		r2 = git.Repo.clone_from(str(Path('upstream').resolve()), 'repo2')
+		upstream.index.commit('Upstream commit')
+		r2.remotes.origin.fetch()
+		r2.index.commit('Local commit')
+		Path('repo3/deps.got').write_text('')
+		r3.index.add(['deps.got'])
+		r3.index.commit('Commit')
+		r3.git.checkout(r3.head.commit.hexsha)
+		Path('repo3/deps.got').write_text('repo1\n')
+
+		with GotRun(['--status', '--format', 'json']) as r:
+			statuses = fromJS(r.stdout)
+		self.assertEqual(list(statuses.keys()), ['host:repo1', 'host:repo2', 'host:repo3'])
+		self.assertEqual(statuses['host:repo1'], {'path': str(Path('repo1').resolve()), 'branch': 'master', 'head': r1.head.commit.hexsha, 'upstream': None, 'ahead': None, 'behind': None, 'dirty': False, 'last_fetch': None})
+		self.assertEqual((statuses['host:repo2']['upstream'], statuses['host:repo2']['ahead'], statuses['host:repo2']['behind']), ('origin/master', 1, 1))
+		self.assertIsNotNone(statuses['host:repo2']['last_fetch'])
+		self.assertEqual((statuses['host:repo3']['branch'], statuses['host:repo3']['dirty']), (None, True))
+
+		with GotRun(['--status']) as r:
+			lines = r.stdout.strip().split(os.linesep)
+			self.assertEqual(len(lines), 3)
+			self.assertEqual(lines[0].split(), ['host:repo1', 'master', 'no', 'upstream', 'clean', 'never', 'fetched'])
+			self.assertIn('ahead 1, behind 1', lines[1])
+			self.assertIn('fetched just now', lines[1])
+			self.assertIn(f"(detached at {r3.head.commit.hexsha[:7]})", lines[2])
+			self.assertIn('dirty', lines[2])
+
+		with GotRun(['--status', 'repo1', 'host:repo3', '--format', 'json']) as r:
+			self.assertEqual(list(fromJS(r.stdout).keys()), ['host:repo1', 'host:repo3'])
+		with GotRun(['--status', 'nonexistent']) as r:
+			r.assertFails()
+
+		# Statuses are cached until the files they came from change. Recently modified files aren't trusted, so backdate them
+		past = time.time() - 60
+		os.utime('repo1/deps.got', (past - 10, past - 10))
+		r1.git.status()
+		for path in Path('repo1/.git').rglob('*'):
+			os.utime(path, (past, past))
+		with GotRun(['--status', 'repo1', '--format', 'json']) as r:
+			self.assertFalse(fromJS(r.stdout)['host:repo1']['dirty'])
+		# Mark the cached entry so it's visible when it gets reused
+		conn = sqlite3.connect('db', isolation_level = None)
+		status = fromJS(conn.execute("SELECT status FROM clone_statuses").fetchone()[0])
+		conn.execute("UPDATE clone_statuses SET status = ?", (toJS({**status, 'upstream': 'cached'}),))
+		conn.close()
+		with GotRun(['--status', 'repo1', '--format', 'json']) as r:
+			self.assertEqual(fromJS(r.stdout)['host:repo1']['upstream'], 'cached')
+		# Unstaged edits don't invalidate the entry, but are still noticed
+		Path('repo1/deps.got').write_text('repo2\n')
+		with GotRun(['--status', 'repo1', '--format', 'json']) as r:
+			self.assertEqual((fromJS(r.stdout)['host:repo1']['upstream'], fromJS(r.stdout)['host:repo1']['dirty']), ('cached', True))
+		with GotRun(['--status', 'repo1', '--format', 'json', '--no-cache']) as r:
+			self.assertEqual((fromJS(r.stdout)['host:repo1']['upstream'], fromJS(r.stdout)['host:repo1']['dirty']), (None, True))
+		r1.index.add(['deps.got'])
+		with GotRun(['--status', 'repo1', '--format', 'json']) as r:
+			self.assertTrue(fromJS(r.stdout)['host:repo1']['dirty'])
+
 	def test_git_ignore_errors(self):
 		_, r2, _ = self.git_helper()
 		with GotRun(['--git', '-C', 'repo1', '--ignore-errors', 'show', r2.head.commit.hexsha]) as r:
 			r.assertInStdout('Ignored error')
 
-	all_config_keys = ['clone_retries', 'clone_root', 'default_branch']
+	def test_git_reads_deps_after_command(self):
+		r1, r2, r3 = self.git_helper()
+		# On branch 'other', repo1 only depends on repo2
+		r1.create_head('other').checkout()
+		Path('repo1/deps.got').write_text("repo2\n")
+		r1.index.add(['deps.got'])
+		r1.index.commit('Drop repo3')
+		r1.heads.master.checkout()
+		with GotRun(['--git', '-C', 'repo1', '--ignore-errors', 'checkout', 'other']) as r:
+			r.assertInStdout('host:repo2')
+			self.assertNotIn('host:repo3', r.stdout)
+
+	all_config_keys = ['clone_jobs', 'clone_retries', 'clone_retry_delay', 'clone_retry_max_delay', 'clone_root', 'default_branch', 'git_fsmonitor', 'run_cache_max_age', 'run_cache_max_size', 'run_job_memory', 'run_max_cpu', 'run_max_jobs', 'ssh_control_persist']
 
 	def test_config_list_all(self):
 		with GotRun(['--config']) as r:
@@ -1124,6 +1699,87 @@ class Tests(TestCase):
 				r.assertInStderr(spec)
 				r.assertInStdout(str(Path(spec).resolve()))
 
+	def test_run_ssh_env(self):
+		if platform.system() == 'Windows':
+			self.skipTest("SSH connection sharing isn't supported on Windows")
+		if 'GIT_SSH_COMMAND' in os.environ or 'GIT_SSH' in os.environ:
+			self.skipTest("got doesn't override a custom ssh command")
+		self.deps_helper()
+		with GotRun(['--run', 'repo1', '-x', 'echo "ssh: $GIT_SSH_COMMAND"']) as r:
+			r.assertInStdout(f"ControlPath=\"{Path('ssh/host').resolve()}/%C\"")
+			r.assertInStdout('ControlPersist=60')
+		with GotRun(['--config', 'ssh_control_persist', '0']):
+			pass
+		with GotRun(['--run', 'repo1', '-x', 'echo "ssh: $GIT_SSH_COMMAND"']) as r:
+			self.assertNotIn('ControlPath', r.stdout)
+
+	def test_ssh_multiplexing(self):
+		# Fetches share one SSH master connection per host. This needs a Bitbucket host reachable over SSH
+		if platform.system() == 'Windows':
+			self.skipTest("SSH connection sharing isn't supported on Windows")
+		hostData = self.addBitbucketHost('bitbucket')
+		if 'sshKey' not in hostData:
+			self.skipTest("Bitbucket host doesn't have an SSH key")
+		repospec = hostData['repospecs'][0]
+		with GotRun([repospec]) as r:
+			path = r.stdout.strip()
+
+		def fetch():
+			with GotRun(['--git', '-C', path, 'fetch']) as r:
+				r.assertWorks()
+
+		def masterPid(socket: Path) -> str:
+			proc = subprocess.run(['ssh', '-o', f"ControlPath={socket}", '-O', 'check', 'bitbucket'], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+			self.assertEqual(proc.returncode, 0, proc.stdout)
+			return re.search(r'pid=(\d+)', proc.stdout).group(1)
+
+		# With sharing turned off, no master connection is left behind
+		with GotRun(['--config', 'ssh_control_persist', '0']):
+			pass
+		fetch()
+		self.assertFalse(Path('ssh/bitbucket').is_dir() and any(Path('ssh/bitbucket').iterdir()))
+
+		# Otherwise the first fetch starts a master connection, and the second one reuses it instead of starting another
+		with GotRun(['--config', 'ssh_control_persist', '60']):
+			pass
+		fetch()
+		sockets = list(Path('ssh/bitbucket').iterdir())
+		self.assertEqual(len(sockets), 1)
+		pid = masterPid(sockets[0])
+		fetch()
+		self.assertEqual(list(Path('ssh/bitbucket').iterdir()), sockets)
+		self.assertEqual(masterPid(sockets[0]), pid)
+
+		# Removing the host shuts the connection down
+		with GotRun(['--rm-host', 'bitbucket']):
+			pass
+		self.assertFalse(any(Path('ssh/bitbucket').iterdir()))
+
+	def test_ssh_multiplexing_benchmark(self):
+		# Compares fetch times with and without a shared SSH connection. This needs a Bitbucket host reachable over SSH
+		if not args.benchmarks:
+			self.skipTest("Benchmarks only run with --benchmarks")
+		if platform.system() == 'Windows':
+			self.skipTest("SSH connection sharing isn't supported on Windows")
+		hostData = self.addBitbucketHost('bitbucket')
+		if 'sshKey' not in hostData:
+			self.skipTest("Bitbucket host doesn't have an SSH key")
+		repospec = hostData['repospecs'][0]
+		with GotRun([repospec]) as r:
+			path = r.stdout.strip()
+
+		def timeFetches(persist, n = 5):
+			with GotRun(['--config', 'ssh_control_persist', persist]):
+				pass
+			start = timeit.default_timer()
+			for _ in range(n):
+				with GotRun(['--git', '-C', path, 'fetch']) as r:
+					r.assertWorks()
+			return (timeit.default_timer() - start) / n
+
+		unshared, shared = timeFetches('0'), timeFetches('60')
+		print(f"Average fetch: {unshared:.2f}s without a shared connection, {shared:.2f}s with")
+
 	def test_run_bg(self):
 		self.deps_helper()
 		# Want a command to run for 10 seconds. This is surprisingly hard on Windows, 'timeout' is really poorly implemented
@@ -1137,6 +1793,215 @@ class Tests(TestCase):
 			end = timeit.default_timer()
 			self.assertTrue(end - start < 25)
 
+	def test_run_jobs(self):
+		if platform.system() == 'Windows':
+			self.skipTest("Uses POSIX shell commands")
+		self.deps_helper()
+		specs = ['repo1', 'repo2', 'repo3', 'repo4']
+		# 4 invocations of 2 seconds each, 2 at a time
+		with GotRun(['--run'] + specs + ['-j', '2', '-x', 'echo start; sleep 2; echo end']) as r:
+			start = timeit.default_timer()
+			r.assertWorks()
+			end = timeit.default_timer()
+			self.assertTrue(4 <= end - start < 8)
+			# Each repo's output is kept together
+			for spec in specs:
+				r.assertInStdout(f"host:{spec}{os.linesep}start{os.linesep}end{os.linesep}")
+				self.assertTrue(re.search(f"^host:{spec} +0 +[0-9.]+s$", r.stderr, re.MULTILINE))
+
+		with GotRun(['--run'] + specs + ['-j', '1', '--stream', '-x', 'echo out; test "$GOT_REPOSPEC" != host:repo2']) as r:
+			r.assertExitCode(1)
+			self.assertEqual(r.stdout.split(os.linesep)[:2], ['host:repo1: out', 'host:repo2: out'])
+			# Nothing else is started after a failure
+			self.assertTrue(re.search('^host:repo2 +1 ', r.stderr, re.MULTILINE))
+			self.assertTrue(re.search('^repo3 +- +skipped$', r.stderr, re.MULTILINE))
+
+		with GotRun(['--run'] + specs + ['-j', '2', '--ignore-errors', '-x', 'test "$GOT_REPOSPEC" != host:repo2']) as r:
+			r.assertExitCode(1)
+			self.assertNotIn('skipped', r.stderr)
+
+		with GotRun(['--run'] + specs + ['-j', '2', '--bg', '-x', 'true']) as r:
+			r.assertFails()
+
+	def test_run_topo(self):
+		if platform.system() == 'Windows':
+			self.skipTest("Uses POSIX shell commands")
+		self.deps_helper()
+		log = Path('log').resolve()
+		cmd = f'echo "start $GOT_REPOSPEC" >> {log}; sleep 1; echo "end $GOT_REPOSPEC" >> {log}'
+		with GotRun(['--run', 'repo1+', '--topo', '-j', '4', '-x', cmd]) as r:
+			start = timeit.default_timer()
+			r.assertWorks()
+			end = timeit.default_timer()
+		events = log.read_text().splitlines()
+		def position(event, spec):
+			return events.index(f"{event} host:{spec}")
+		# Each repo only starts once its dependencies are done, but independent repos run together
+		self.assertGreater(position('start', 'repo2'), position('end', 'repo4'))
+		self.assertGreater(position('start', 'repo1'), position('end', 'repo2'))
+		self.assertGreater(position('start', 'repo1'), position('end', 'repo3'))
+		self.assertLess(position('start', 'repo3'), position('end', 'repo4'))
+		self.assertTrue(3 <= end - start < 6)
+
+		# Dependents of a failed repo are skipped, but everything else runs
+		log.unlink()
+		with GotRun(['--run', 'repo1+', '--topo', '-i', '-x', f'echo "$GOT_REPOSPEC" >> {log}; test "$GOT_REPOSPEC" != host:repo4']) as r:
+			r.assertExitCode(1)
+			for spec in ('repo1', 'repo2'):
+				self.assertTrue(re.search(f"^host:{spec} +- +skipped$", r.stderr, re.MULTILINE))
+		self.assertEqual(sorted(log.read_text().splitlines()), ['host:repo3', 'host:repo4'])
+
+		Path('repo4/deps.got').write_text('repo1')
+		with GotRun(['--run', 'repo1', 'repo2', 'repo4', '--topo', '-x', 'true']) as r:
+			r.assertFails()
+			r.assertInStderr('Dependency cycle: ')
+
+	def test_run_cache(self):
+		if platform.system() == 'Windows':
+			self.skipTest("Uses POSIX shell commands")
+		r1, r2, r3 = self.git_helper()
+		log = Path('log').resolve()
+		cmd = f'echo "$GOT_REPOSPEC" >> {log}; echo "out $GOT_TEST_VAR"'
+		def runs(*args):
+			log.write_text('')
+			with GotRun(['--run', 'repo1', 'repo2', 'repo3', '--cache-env', 'GOT_TEST_VAR', *args, '-x', cmd]) as r:
+				r.assertWorks()
+				return sorted(log.read_text().splitlines()), r.stdout, r.stderr
+
+		os.environ['GOT_TEST_VAR'] = 'a'
+		try:
+			self.assertEqual(runs('-j', '2')[0], ['host:repo1', 'host:repo2', 'host:repo3'])
+			# Nothing has changed, so the recorded results are replayed
+			ran, stdout, stderr = runs('-j', '2')
+			self.assertEqual(ran, [])
+			self.assertIn(f"host:repo1 (cached){os.linesep}out a", stdout)
+			self.assertTrue(re.search('^host:repo1 +0 +cached$', stderr, re.MULTILINE))
+			self.assertEqual(runs()[0], [])
+
+			# A new commit, uncommitted changes, or a different value of a chosen environment variable mean running again
+			r2.index.commit('Another commit')
+			Path('repo3/untracked').write_text('')
+			self.assertEqual(runs()[0], ['host:repo2', 'host:repo3'])
+			# repo2's output wasn't captured by the serial run, so it runs again rather than replaying nothing
+			ran, stdout, _ = runs('-j', '2')
+			self.assertEqual(ran, ['host:repo2', 'host:repo3'])
+			self.assertIn(f"host:repo2{os.linesep}out a", stdout)
+			ran, stdout, _ = runs('-j', '2')
+			self.assertEqual(ran, ['host:repo3'])
+			self.assertIn(f"host:repo2 (cached){os.linesep}out a", stdout)
+			os.environ['GOT_TEST_VAR'] = 'b'
+			self.assertEqual(runs('-j', '2', '--stream')[0], ['host:repo1', 'host:repo2', 'host:repo3'])
+			ran, stdout, _ = runs('-j', '2', '--stream')
+			self.assertEqual(ran, ['host:repo3'])
+			self.assertIn('host:repo1: out b', stdout)
+		finally:
+			del os.environ['GOT_TEST_VAR']
+
+		# Without --cache, everything runs
+		log.write_text('')
+		with GotRun(['--run', 'repo1', 'repo2', '-x', cmd]):
+			pass
+		self.assertEqual(sorted(log.read_text().splitlines()), ['host:repo1', 'host:repo2'])
+
+		self.assertTrue(any(Path('run-cache').iterdir()))
+		with GotRun(['--config', 'run_cache_max_size', '0']):
+			pass
+		with GotRun(['--run', 'repo1', '--cache', '-x', 'true']):
+			pass
+		self.assertFalse(any(Path('run-cache').iterdir()))
+
+	def test_run_bg_limits(self):
+		self.deps_helper()
+		cmd = 'ping 127.0.0.1 -n 3' if platform.system() == 'Windows' else 'sleep 2'
+		specs = ['repo1', 'repo2', 'repo3']
+		# At most one at a time means running them one after another
+		with GotRun(['--config', 'run_max_jobs', '1']):
+			pass
+		with GotRun(['--run'] + specs + ['--bg', '-x', cmd]) as r:
+			start = timeit.default_timer()
+			r.assertWorks()
+			end = timeit.default_timer()
+			self.assertTrue(end - start >= 6)
+
+		# The CPU ceiling can be too low for anything to ever start, but one process is always allowed
+		with GotRun(['--config', 'run_max_jobs', '0']):
+			pass
+		with GotRun(['--config', 'run_max_cpu', '0.001']):
+			pass
+		with GotRun(['--run'] + specs + ['--bg', '-x', 'true']) as r:
+			r.assertWorks()
+
+		for value in ('0', '101', 'foo'):
+			with GotRun(['--config', 'run_max_cpu', value]) as r:
+				r.assertFails()
+
+	def test_report(self):
+		self.deps_helper()
+		cmd = 'if exist deps.got exit 1' if platform.system() == 'Windows' else '! test -e deps.got'
+
+		# repo1 fails, so repo2 is never started
+		with GotRun(['--run', 'repo3', 'repo1', 'repo2', '-j', '1', '--report', 'report.json', '-x', cmd]) as r:
+			r.assertExitCode(1)
+		report = fromJS(Path('report.json').read_text())
+		self.assertEqual(report['command'], 'run')
+		results = {Path(result['path'] or result['repospec']).name: result for result in report['repos']}
+		self.assertEqual(results['repo3']['exit_code'], 0)
+		self.assertEqual(results['repo1']['exit_code'], 1)
+		self.assertTrue(results['repo2']['skipped'])
+		for name in ('repo3', 'repo1'):
+			self.assertEqual(results[name]['repospec'], f"host:{name}")
+			self.assertGreaterEqual(results[name]['duration'], results[name]['resolve_time'])
+
+		# Serial runs are reported too, including the one that failed
+		with GotRun(['--run', 'repo3', 'repo1', '--report', 'report.json', '-x', cmd]) as r:
+			r.assertFails()
+		report = fromJS(Path('report.json').read_text())
+		self.assertEqual([result['exit_code'] for result in report['repos']], [0, 1])
+
+		with GotRun(['--where', 'repo1', 'repo2', 'repo3', '--report', 'report.json']) as r:
+			r.assertWorks()
+		report = fromJS(Path('report.json').read_text())
+		self.assertEqual([result['repospec'] for result in report['repos']], ['host:repo1', 'host:repo2', 'host:repo3'])
+		self.assertTrue(all(result['exit_code'] == 0 and result['error'] is None for result in report['repos']))
+
+	def test_report_junit(self):
+		r1, r2, r3 = self.git_helper()
+		with GotRun(['--git', '-C', 'repo1', '--report', 'report.xml', 'status']) as r:
+			r.assertWorks()
+		suite = ET.parse('report.xml').getroot()
+		self.assertEqual(suite.tag, 'testsuite')
+		self.assertEqual((suite.get('tests'), suite.get('failures'), suite.get('errors')), ('3', '0', '0'))
+		self.assertEqual(sorted(case.get('name') for case in suite.iter('testcase')), ['host:repo1', 'host:repo2', 'host:repo3'])
+
+		with GotRun(['--git', '-C', 'repo1', '--report', 'report.xml', '--ignore-errors', 'checkout', 'no-such-branch']) as r:
+			r.assertWorks()
+		suite = ET.parse('report.xml').getroot()
+		self.assertEqual(suite.get('failures'), '3')
+		self.assertEqual(len(list(suite.iter('failure'))), 3)
+
+	def test_report_bytes_fetched(self):
+		self.commit_helper('repo2')
+		self.commit_helper('repo1', 'repo2')
+		self.addHost('daemon', 'host', os.path.realpath('host'))
+
+		def fetched():
+			return {result['repospec']: result['bytes_fetched'] for result in fromJS(Path('report.json').read_text())['repos']}
+
+		# Repos cloned while resolving count everything they fetched; existing clones that don't fetch count nothing
+		with GotRun(['--run', 'repo1', '--report', 'report.json', '-x', 'true']) as r:
+			r.assertWorks()
+		self.assertGreater(fetched()['host:repo1'], 0)
+		with GotRun(['--git', '-C', 'repos/host/repo1', '--report', 'report.json', 'status']) as r:
+			r.assertWorks()
+		self.assertEqual(fetched()['host:repo1'], 0)
+		self.assertGreater(fetched()['host:repo2'], 0)
+
+		# Cached results aren't measured
+		for _ in range(2):
+			with GotRun(['--run', 'repo1', '-j', '1', '--cache', '--report', 'report.json', '-x', 'true']) as r:
+				r.assertWorks()
+		self.assertIsNone(fetched()['host:repo1'])
+
 	def test_run_ignore_errors(self):
 		self.deps_helper()
 		with GotRun(['--run', 'repo1', 'repo2', 'repo3', '--ignore-errors', '-x', 'command-that-does-not-exist']) as r: